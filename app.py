@@ -1,13 +1,27 @@
+import os
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from database import DatabaseManager
-from etl_pipeline import PortfolioETL
-import yfinance as yf
+from database import DatabaseManager, DEFAULT_PORTFOLIO_ID
+from quote_cache import get_quote_cache
+from holdings_store import get_holdings_store
+from refresh_worker import get_refresh_worker
+from snapshot_archive import get_snapshot_archive
+from valuation import value_holdings, summarize
 from datetime import datetime
 
 st.set_page_config(page_title="Portfolio Analytics", layout="wide")
 
+# Latest prices shared across sessions and reruns
+quote_cache = get_quote_cache()
+
+# Background ETL runs, shared by every session
+refresh_worker = get_refresh_worker()
+
+# Holdings shared by every session (and the ETL); read once per render
+holdings_store = get_holdings_store()
+portfolio_df = holdings_store.load()
+
 # Title
 st.title("Portfolio Analytics Dashboard")
 st.markdown("---")
@@ -25,20 +39,8 @@ with st.sidebar:
         submitted = st.form_submit_button("Add to Portfolio")
         
         if submitted:
-            # Add to CSV file
-            new_data = pd.DataFrame({
-                'Ticker': [ticker.upper()],
-                'Quantity': [quantity],
-                'PurchasePrice': [purchase_price]
-            })
-            
-            try:
-                existing_data = pd.read_csv('portfolio.csv')
-                updated_data = pd.concat([existing_data, new_data], ignore_index=True)
-            except:
-                updated_data = new_data
-                
-            updated_data.to_csv('portfolio.csv', index=False)
+            # Add a lot to the holdings store
+            holdings_store.add(ticker, quantity, purchase_price)
             st.success(f"Added {quantity} shares of {ticker.upper()} at ${purchase_price}")
             st.rerun()
     
@@ -46,7 +48,7 @@ with st.sidebar:
     st.markdown("---")
     st.subheader("Current Portfolio")
     try:
-        current_portfolio = pd.read_csv('portfolio.csv')
+        current_portfolio = portfolio_df
         
         # Display the portfolio
         st.dataframe(current_portfolio, use_container_width=True)
@@ -68,8 +70,7 @@ with st.sidebar:
                 
                 if delete_submitted:
                     # Remove the selected ticker
-                    updated_portfolio = current_portfolio[current_portfolio['Ticker'] != ticker_to_delete]
-                    updated_portfolio.to_csv('portfolio.csv', index=False)
+                    holdings_store.remove(ticker_to_delete)
                     st.success(f"Deleted {ticker_to_delete} from portfolio!")
                     st.rerun()
                 elif delete_submitted and not confirm_delete:
@@ -82,22 +83,56 @@ with st.sidebar:
 
 
     st.markdown("---")
-    # Run ETL button
+    cache_stats = quote_cache.stats()
+    st.caption(f"Quote cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+               f"(TTL {cache_stats['ttl']:.0f}s, {cache_stats['stale']} stale)")
+    # Run ETL button: the run happens on a shared background worker, and
+    # clicks from every session while it is in flight join the same run
     if st.button("Refresh", type="primary"):
-        with st.spinner("Fetching latest data..."):
-            try:
-                etl = PortfolioETL()
-                db = DatabaseManager()
-                
-                db.connect()
-                portfolio_details, portfolio_metrics = etl.run()
-                db.save_initial_holdings(portfolio_details)
-                db.save_portfolio_snapshot(portfolio_details, portfolio_metrics)
-                db.close()
-                
-                st.success("Portfolio data updated successfully!")
-            except Exception as e:
-                st.error(f"Error: {e}")
+        st.session_state['refresh_job'] = refresh_worker.request().id
+        st.session_state.pop('refresh_result', None)
+    
+    # Poll once a second only while this session waits on a job
+    @st.fragment(run_every=1 if 'refresh_job' in st.session_state else None)
+    def refresh_status():
+        job_id = st.session_state.get('refresh_job')
+        job = refresh_worker.job(job_id) if job_id else None
+        if job_id and job is None:
+            # Aged out of the worker's history; stop polling for it
+            del st.session_state['refresh_job']
+            st.rerun()
+        if job is not None and not job.done:
+            st.progress(job.progress, text=f"Refreshing ({job.stage})...")
+            return
+        if job is not None:
+            # Keep the outcome until the next Refresh or Dismiss, across reruns
+            del st.session_state['refresh_job']
+            if job.status == 'failed':
+                st.session_state['refresh_result'] = ('error', f"Error: {job.error}")
+            elif job.outcome == 'no_change':
+                st.session_state['refresh_result'] = ('info', "No change since the last refresh.")
+            else:
+                st.session_state['refresh_result'] = ('success', "Portfolio data updated successfully!")
+            # Redraw the whole page against the new snapshot, which also stops the polling
+            st.rerun()
+        
+        result = st.session_state.get('refresh_result')
+        if result:
+            kind, message = result
+            getattr(st, kind)(message)
+            if st.button("Dismiss", key='dismiss_refresh'):
+                del st.session_state['refresh_result']
+                st.rerun(scope='fragment')
+    
+    refresh_status()
+
+# Quotes first: a slow provider must not keep a pooled connection borrowed
+tickers = portfolio_df['Ticker'].tolist()
+try:
+    price_data = quote_cache.get_prices(tickers) if tickers else pd.Series(dtype=float)
+except Exception as e:
+    st.error(f"Error fetching prices: {e}")
+    price_data = pd.Series(dtype=float)
 
 # Connect to database
 db = DatabaseManager()
@@ -112,38 +147,19 @@ try:
     
     try:
         # Get latest portfolio metrics from database
-        with db.conn.cursor() as cur:
-            cur.execute("""
-                SELECT total_value, total_return, volatility, sharpe_ratio
-                FROM portfolio_snapshots 
-                ORDER BY snapshot_date DESC 
-                LIMIT 1
-            """)
-            latest = cur.fetchone()
+        latest = db.get_latest_metrics(DEFAULT_PORTFOLIO_ID)
         
-        # Read current portfolio for calculation
-        portfolio_df = pd.read_csv('portfolio.csv')
-        tickers = portfolio_df['Ticker'].tolist()
-        
-        # Get current prices for live calculations
         if tickers:
-            price_data = yf.download(tickers, period="1d", auto_adjust=True)['Close'].iloc[-1]
-            
             # Calculate live metrics
-            total_invested = 0
-            total_current = 0
+            totals = summarize(value_holdings(portfolio_df, price_data))
+            total_invested = totals['total_cost_basis']
+            total_current = totals['total_market_value']
+            total_gain_loss = totals['total_unrealized_pnl']
+            total_gain_loss_pct = totals['total_return_percent']
             
-            for _, row in portfolio_df.iterrows():
-                ticker = row['Ticker']
-                quantity = row['Quantity']
-                purchase_price = row['PurchasePrice']
-                current_price = price_data[ticker] if ticker in price_data.index else 0
-                
-                total_invested += quantity * purchase_price
-                total_current += quantity * current_price
-            
-            total_gain_loss = total_current - total_invested
-            total_gain_loss_pct = (total_gain_loss / total_invested) * 100 if total_invested > 0 else 0
+            if totals['missing_prices']:
+                st.warning(f"No current price for {totals['missing_prices']} holdings; "
+                           "they are excluded from these totals")
             
             # Display all metrics together
             with col1:
@@ -181,39 +197,23 @@ try:
     st.subheader("Stock Performance vs Purchase Price")
     
     try:
-        # Read portfolio from CSV
-        portfolio_df = pd.read_csv('portfolio.csv')
-        tickers = portfolio_df['Ticker'].tolist()
-        
-        # Get current prices
-        price_data = yf.download(tickers, period="1d", auto_adjust=True)['Close'].iloc[-1]
-        
         # Calculate performance
-        perf_data = []
-        for _, row in portfolio_df.iterrows():
-            ticker = row['Ticker']
-            quantity = row['Quantity']
-            purchase_price = row['PurchasePrice']
-            current_price = price_data[ticker] if ticker in price_data.index else 0
-            
-            total_invested = quantity * purchase_price
-            current_value = quantity * current_price
-            gain_loss = current_value - total_invested
-            gain_loss_pct = (gain_loss / total_invested) * 100 if total_invested > 0 else 0
-            
-            perf_data.append({
-                'Ticker': ticker,
-                'Quantity': quantity,
-                'Purchase Price': purchase_price,
-                'Current Price': current_price,
-                'Total Invested': total_invested,
-                'Current Value': current_value,
-                'Gain/Loss ($)': gain_loss,
-                'Gain/Loss (%)': gain_loss_pct,
-                'Is Positive': gain_loss_pct > 0  # For color coding
-            })
+        valued = value_holdings(portfolio_df, price_data)
+        if valued['PriceMissing'].any():
+            st.warning("No current price for: " + ", ".join(valued.loc[valued['PriceMissing'], 'Ticker']))
+        stale = quote_cache.stale_tickers(tickers)
+        if stale:
+            st.info("Quote fetch failed; showing last known price for: " + ", ".join(stale))
         
-        perf_df = pd.DataFrame(perf_data)
+        perf_df = valued[~valued['PriceMissing']].rename(columns={
+            'PurchasePrice': 'Purchase Price',
+            'CurrentPrice': 'Current Price',
+            'CostBasis': 'Total Invested',
+            'MarketValue': 'Current Value',
+            'UnrealizedPnl': 'Gain/Loss ($)',
+            'UnrealizedPnlPercent': 'Gain/Loss (%)'
+        })
+        perf_df['Is Positive'] = perf_df['Gain/Loss (%)'] > 0  # For color coding
         
         # Sort by Gain/Loss % (highest gain to highest loss)
         perf_df = perf_df.sort_values('Gain/Loss (%)', ascending=False)
@@ -271,21 +271,42 @@ try:
     st.markdown("---")
     st.subheader("Portfolio Allocation")
     
-    with db.conn.cursor() as cur:
-        cur.execute("""
-            SELECT ticker, market_value 
-            FROM holdings_snapshot 
-            WHERE snapshot_date = (SELECT MAX(snapshot_date) FROM holdings_snapshot)
-        """)
-        holdings_data = cur.fetchall()
-        
-        if holdings_data:
-            holdings_df = pd.DataFrame(holdings_data, columns=['Ticker', 'Value'])
-            fig = px.pie(holdings_df, values='Value', names='Ticker', 
-                        title="Current Asset Allocation")
-            st.plotly_chart(fig, use_container_width=True)
+    holdings_df = db.get_latest_allocation(DEFAULT_PORTFOLIO_ID)
     
-    db.close()
+    if not holdings_df.empty:
+        fig = px.pie(holdings_df, values='Value', names='Ticker', 
+                    title="Current Asset Allocation")
+        st.plotly_chart(fig, use_container_width=True)
+    
+    # Value and P&L history
+    st.markdown("---")
+    st.subheader("Portfolio History")
+    
+    history_ranges = {'1 Month': 30, '3 Months': 91, '1 Year': 365, 'All': None}
+    history_range = st.selectbox("Range", list(history_ranges), index=2)
+    days = history_ranges[history_range]
+    # Read from the Parquet archive when one is configured, else from Postgres
+    history_source = get_snapshot_archive() if os.environ.get('SNAPSHOT_ARCHIVE') else db
+    history_df = history_source.get_portfolio_history(
+        DEFAULT_PORTFOLIO_ID,
+        start=datetime.now() - pd.Timedelta(days=days) if days else None
+    )
+    
+    if history_df.empty:
+        st.info("No snapshots in this range yet.")
+    else:
+        fig = px.line(history_df, x='snapshot_date', y='total_value',
+                      title="Portfolio Value",
+                      labels={'snapshot_date': 'Date', 'total_value': 'Value ($)'})
+        st.plotly_chart(fig, use_container_width=True)
+    
+        if history_df['total_unrealized_pnl'].notna().any():
+            fig = px.line(history_df, x='snapshot_date', y='total_unrealized_pnl',
+                          title="Unrealized P&L",
+                          labels={'snapshot_date': 'Date', 'total_unrealized_pnl': 'P&L ($)'})
+            st.plotly_chart(fig, use_container_width=True)
     
 except Exception as e:
     st.error(f"Database error: {e}")
+finally:
+    db.close()
@@ -0,0 +1,126 @@
+import argparse
+import numpy as np
+import pandas as pd
+from etl_pipeline import PortfolioETL
+from database import DatabaseManager, DEFAULT_PORTFOLIO_ID, close_pool
+from market_data import get_provider
+from risk import TRADING_DAYS
+
+# Backfilled snapshots are stamped at the close of each trading day
+SNAPSHOT_HOUR = 16
+# Calendar days of extra history loaded so the first backfilled day has a full window
+HISTORY_LOOKBACK_DAYS = 400
+
+
+def backfill_frames(holdings_df, historical_data, start, end):
+    """Daily portfolio_snapshots and holdings_snapshot rows for closed trading days in [start, end].
+
+    Holdings are taken as constant over the range. Every day is valued in one
+    (days x tickers) matrix product; the trailing metrics come from rolling
+    TRADING_DAYS windows over the daily return of those holdings, so weights
+    drift with prices the way a buy-and-hold portfolio's do.
+    """
+    tickers = list(dict.fromkeys(holdings_df['Ticker']))
+    closes = historical_data.reindex(columns=tickers).ffill()
+    quantities = holdings_df.groupby('Ticker')['Quantity'].sum().reindex(tickers).to_numpy(dtype=float)
+    costs = (
+        (holdings_df['Quantity'] * holdings_df['PurchasePrice'])
+        .groupby(holdings_df['Ticker']).sum().reindex(tickers).to_numpy(dtype=float)
+    )
+
+    # Portfolio value per day, over holdings that have a price that day (as summarize does)
+    values = closes.to_numpy(dtype=float) * quantities
+    priced = ~np.isnan(values)
+    total_value = np.where(priced, values, 0).sum(axis=1)
+    total_cost = np.where(priced, costs, 0).sum(axis=1)
+
+    # Daily return over holdings priced on both days, so listings don't show up as gains
+    previous = np.vstack([np.full((1, len(tickers)), np.nan), values[:-1]])
+    both = priced & ~np.isnan(previous)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_returns = pd.Series(
+            np.where(both, values - previous, 0).sum(axis=1) / np.where(both, previous, 0).sum(axis=1),
+            index=closes.index
+        )
+
+    window = daily_returns.rolling(TRADING_DAYS, min_periods=TRADING_DAYS)
+    volatility = window.std() * np.sqrt(TRADING_DAYS)
+    sharpe_ratio = window.mean() * TRADING_DAYS / volatility
+
+    # A session whose close hasn't happened yet only has a partial price; leave it to live runs
+    closed = closes.index + pd.Timedelta(hours=SNAPSHOT_HOUR) <= pd.Timestamp.now()
+    days = (closes.index >= pd.Timestamp(start)) & (closes.index <= pd.Timestamp(end)) & closed
+    snapshot_dates = closes.index[days].normalize() + pd.Timedelta(hours=SNAPSHOT_HOUR)
+    pnl = total_value[days] - total_cost[days]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_return = np.where(total_cost[days] > 0, pnl / total_cost[days] * 100, 0.0)
+    snapshots = pd.DataFrame({
+        'snapshot_date': snapshot_dates,
+        'total_value': total_value[days],
+        'total_return': total_return,
+        'volatility': volatility[days].to_numpy() * 100,
+        'sharpe_ratio': sharpe_ratio[days].replace([np.inf, -np.inf], np.nan).to_numpy(),
+        'total_unrealized_pnl': pnl
+    })
+
+    # One holdings_snapshot row per (day, lot) with a price
+    lot_columns = closes.columns.get_indexer(holdings_df['Ticker'])
+    lot_prices = closes.to_numpy(dtype=float)[days][:, lot_columns]
+    lot_quantity = holdings_df['Quantity'].to_numpy(dtype=float)
+    lot_cost = lot_quantity * holdings_df['PurchasePrice'].to_numpy(dtype=float)
+    market_value = lot_prices * lot_quantity
+    has_price = ~np.isnan(lot_prices).ravel()
+    holdings_snapshots = pd.DataFrame({
+        'snapshot_date': np.repeat(snapshot_dates.to_numpy(), len(lot_columns)),
+        'ticker': np.tile(holdings_df['Ticker'].astype(str).to_numpy(), len(snapshot_dates)),
+        'quantity': np.tile(holdings_df['Quantity'].astype(int).to_numpy(), len(snapshot_dates)),
+        'current_price': lot_prices.ravel(),
+        'market_value': market_value.ravel(),
+        'unrealized_pnl': (market_value - lot_cost).ravel()
+    })[has_price]
+
+    return snapshots, holdings_snapshots
+
+
+def run_backfill(start, end, portfolio_path=None, portfolio_id=DEFAULT_PORTFOLIO_ID, db=None):
+    """Recompute and (with db) store daily snapshots for [start, end]"""
+    etl = PortfolioETL(portfolio_path=portfolio_path)
+    etl.provider = get_provider()
+    holdings_df = etl.read_holdings()
+    tickers = list(dict.fromkeys(holdings_df['Ticker']))
+
+    window_start = pd.Timestamp(start) - pd.Timedelta(days=HISTORY_LOOKBACK_DAYS)
+    with etl.run_metrics.stage('extract'):
+        # Older than the store's retention window, so don't compact it away again
+        historical_data = etl._load_history(tickers, compact=False, window_start=window_start)
+    with etl.run_metrics.stage('transform'):
+        snapshots, holdings_snapshots = backfill_frames(holdings_df, historical_data, start, end)
+    print(f"Computed {len(snapshots)} daily snapshots, {len(holdings_snapshots)} holding rows")
+
+    if db is not None:
+        with etl.run_metrics.stage('save_backfill'):
+            db.save_backfill(snapshots, holdings_snapshots, portfolio_id)
+    return snapshots, holdings_snapshots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild daily snapshots for a past date range")
+    parser.add_argument('start', help="first day to backfill (YYYY-MM-DD)")
+    parser.add_argument('end', nargs='?', default=pd.Timestamp.today().strftime('%Y-%m-%d'),
+                        help="last day to backfill (default: today); sessions not yet closed are skipped")
+    parser.add_argument('--portfolio', help="portfolio CSV (default: the holdings store)")
+    parser.add_argument('--portfolio-id', default=DEFAULT_PORTFOLIO_ID)
+    args = parser.parse_args()
+
+    db = DatabaseManager()
+
+    try:
+        db.connect()
+        run_backfill(args.start, args.end, args.portfolio, args.portfolio_id, db)
+        print("Backfill completed")
+
+    except Exception as e:
+        print(f"Backfill failed: {e}")
+    finally:
+        db.close()
+        close_pool()
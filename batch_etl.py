@@ -0,0 +1,89 @@
+import argparse
+import os
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from etl_pipeline import PortfolioETL
+from database import DatabaseManager, close_pool
+
+
+def transform_portfolio(portfolio_id, portfolio_df, historical_data, price_data, price_sources):
+    """Value one portfolio against prices that were already extracted (runs in a worker process)"""
+    etl = PortfolioETL()
+    etl.portfolio_df = portfolio_df
+    etl.historical_data = historical_data
+    etl.price_data = price_data
+    etl.price_sources = price_sources
+    portfolio_details, portfolio_metrics = etl.transform()
+    return portfolio_id, portfolio_details, portfolio_metrics
+
+
+def run_batch(portfolio_paths, workers=None):
+    """Run the ETL for many portfolio files, fetching each unique ticker once"""
+    paths_by_id = {}
+    for path in portfolio_paths:
+        paths_by_id.setdefault(os.path.splitext(os.path.basename(path))[0], []).append(path)
+    # The file name is the portfolio id, so a/clients.csv and b/clients.csv would overwrite each other
+    duplicates = {portfolio_id: paths for portfolio_id, paths in paths_by_id.items() if len(paths) > 1}
+    if duplicates:
+        raise ValueError("Duplicate portfolio ids: " + "; ".join(
+            f"{portfolio_id} ({', '.join(paths)})" for portfolio_id, paths in duplicates.items()
+        ))
+    portfolios = {portfolio_id: pd.read_csv(paths[0]) for portfolio_id, paths in paths_by_id.items()}
+    print(f"Loaded {len(portfolios)} portfolios")
+
+    # One extract over the union of tickers
+    tickers = list(dict.fromkeys(
+        ticker for portfolio_df in portfolios.values() for ticker in portfolio_df['Ticker']
+    ))
+    etl = PortfolioETL()
+    etl.extract_prices(tickers)
+
+    # Each worker only receives the price columns its portfolio needs
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for portfolio_id, portfolio_df in portfolios.items():
+            own = list(dict.fromkeys(portfolio_df['Ticker']))
+            futures.append(pool.submit(
+                transform_portfolio,
+                portfolio_id,
+                portfolio_df,
+                etl.historical_data.reindex(columns=own),
+                etl.price_data.reindex(own),
+                etl.price_sources.reindex(own)
+            ))
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Portfolio failed: {e}")
+
+    # All portfolios in a batch share one snapshot time
+    snapshot_date = datetime.now()
+    for _, _, portfolio_metrics in results:
+        portfolio_metrics['timestamp'] = snapshot_date
+
+    print(f"Transformed {len(results)} of {len(portfolios)} portfolios")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the portfolio ETL for many portfolio CSV files")
+    parser.add_argument('portfolios', nargs='+', help="portfolio CSV files; the file name is the portfolio id")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    db = DatabaseManager()
+
+    try:
+        db.connect()
+        results = run_batch(args.portfolios, workers=args.workers)
+        db.save_batch(results)
+        print("Batch ETL completed")
+
+    except Exception as e:
+        print(f"Batch ETL failed: {e}")
+    finally:
+        db.close()
+        close_pool()
@@ -0,0 +1,157 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from etl_pipeline import PortfolioETL
+from market_data import ChunkedProvider, FakeProvider
+from price_store import PriceStore
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 50000]
+RESULTS_DIR = 'benchmark_results'
+# A stage is flagged when it is this much slower than the previous saved run
+REGRESSION_THRESHOLD = 0.20
+# ...and by at least this many seconds, so timer noise on tiny stages is ignored
+REGRESSION_MIN_SECONDS = 0.005
+BENCHMARK_PORTFOLIO_ID = 'benchmark'
+
+
+def synthetic_portfolio(n_tickers, seed=0):
+    """Portfolio frame with n_tickers distinct synthetic symbols"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Ticker': [f"T{i:05d}" for i in range(n_tickers)],
+        'Quantity': rng.integers(1, 500, n_tickers),
+        'PurchasePrice': rng.uniform(5, 500, n_tickers).round(2)
+    })
+
+
+class StageTimer:
+    """Collects wall time, CPU time and peak traced memory per stage"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def time(self, name, rows, func, *args):
+        tracemalloc.reset_peak()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func(*args)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        self.stages[name] = {
+            'seconds': wall,
+            'cpu_seconds': cpu,
+            'peak_memory_mb': tracemalloc.get_traced_memory()[1] / 2**20,
+            'rows_per_second': rows / wall if wall else None
+        }
+        print(f"  {name:<28} {wall * 1000:10.1f} ms  {self.stages[name]['peak_memory_mb']:8.1f} MB")
+        return result
+
+
+def benchmark_size(n_tickers, workdir, db=None, latency=0.0):
+    """Run every ETL stage for one portfolio size"""
+    portfolio_path = os.path.join(workdir, f"portfolio_{n_tickers}.csv")
+    synthetic_portfolio(n_tickers).to_csv(portfolio_path, index=False)
+
+    price_store = PriceStore(os.path.join(workdir, f"prices_{n_tickers}.db"))
+    provider = ChunkedProvider(FakeProvider(latency=latency))
+    etl = PortfolioETL(portfolio_path=portfolio_path, price_store=price_store, provider=provider)
+
+    timer = StageTimer()
+    print(f"{n_tickers} tickers")
+    timer.time('extract_cold', n_tickers, etl.extract)
+    timer.time('extract_warm', n_tickers, etl.extract)
+    portfolio_details, portfolio_metrics = timer.time('transform', n_tickers, etl.transform)
+    timer.time('calculate_portfolio_metrics', n_tickers, etl.calculate_portfolio_metrics)
+
+    if db is not None:
+        timer.time('save_initial_holdings', n_tickers,
+                   db.save_initial_holdings, portfolio_details, BENCHMARK_PORTFOLIO_ID)
+        timer.time('save_portfolio_snapshot', n_tickers,
+                   db.save_portfolio_snapshot, portfolio_details, portfolio_metrics, BENCHMARK_PORTFOLIO_ID)
+
+    price_store.close()
+    return timer.stages
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare_with_previous(results, results_dir):
+    """Print stages that got slower than in the most recent saved run"""
+    previous_files = sorted(glob.glob(os.path.join(results_dir, '*.json')))
+    if not previous_files:
+        return
+    with open(previous_files[-1]) as f:
+        previous = json.load(f)
+
+    print(f"Compared with {os.path.basename(previous_files[-1])} ({previous.get('revision')}):")
+    regressions = 0
+    for size, stages in results['sizes'].items():
+        for stage, current in stages.items():
+            before = previous['sizes'].get(size, {}).get(stage)
+            if not before or not before['seconds']:
+                continue
+            change = current['seconds'] / before['seconds'] - 1
+            if change > REGRESSION_THRESHOLD and current['seconds'] - before['seconds'] > REGRESSION_MIN_SECONDS:
+                regressions += 1
+                print(f"  REGRESSION {size} tickers {stage}: "
+                      f"{before['seconds'] * 1000:.1f} ms -> {current['seconds'] * 1000:.1f} ms "
+                      f"(+{change:.0%})")
+    if not regressions:
+        print("  no regressions")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ETL on synthetic portfolios")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="number of tickers per run")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated provider latency per request, in seconds")
+    parser.add_argument('--db', action='store_true',
+                        help="also time the DB saves (point PGHOST etc. at a local Postgres)")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    db = None
+    if args.db:
+        from database import DatabaseManager
+        db = DatabaseManager()
+        db.connect()
+
+    tracemalloc.start()
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': _git_revision(),
+        'sizes': {}
+    }
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for n_tickers in args.sizes:
+                results['sizes'][str(n_tickers)] = benchmark_size(
+                    n_tickers, workdir, db=db, latency=args.latency
+                )
+    finally:
+        tracemalloc.stop()
+        if db is not None:
+            db.close()
+
+    compare_with_previous(results, args.results_dir)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {path}")
@@ -1,24 +1,92 @@
 import psycopg2
+import psycopg2.pool
+from psycopg2.extras import execute_values
+import io
 import os
+import threading
+import pandas as pd
 from datetime import datetime
+from downsample import lttb
+
+DB_CONFIG = {
+    'host': os.environ.get('PGHOST', 'database-1.cz1wx0qlnvul.us-east-1.rds.amazonaws.com'),
+    'database': os.environ.get('PGDATABASE', 'postgres'),
+    'user': os.environ.get('PGUSER', 'postgres'),
+    'password': os.environ.get('PGPASSWORD', 'HolyMolyZoly'),
+    'port': os.environ.get('PGPORT', '5432'),
+}
+DEFAULT_PORTFOLIO_ID = 'default'
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 10
+# Seconds connect() waits for a free pooled connection before giving up
+POOL_WAIT_TIMEOUT = float(os.environ.get('PG_POOL_WAIT_TIMEOUT', '30'))
+# History charts get at most this many points; the database pre-aggregates
+# to HISTORY_PREAGGREGATION times as many buckets before LTTB picks them
+HISTORY_POINTS = 500
+HISTORY_PREAGGREGATION = 4
+HOLDINGS_SAVE_MODES = ('sync', 'replace')
+
+# Process-wide pool shared by the dashboard and the ETL. Streamlit keeps
+# imported modules alive across reruns, so connections stay warm between pages.
+_pool = None
+_pool_lock = threading.Lock()
+# getconn() raises instead of waiting once every connection is out, so
+# borrowers queue on this first
+_pool_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+_schema_initialized = False
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = psycopg2.pool.ThreadedConnectionPool(MIN_CONNECTIONS, MAX_CONNECTIONS, **DB_CONFIG)
+            print("Database connection pool created")
+        return _pool
+
+
+def close_pool():
+    """Close every pooled connection"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+            print("Database connection pool closed")
+        _pool = None
+
 
 class DatabaseManager:
     def __init__(self):
         self.conn = None
+        self._has_slot = False
+        # Write-path counters, for run instrumentation
+        self.round_trips = 0
+        self.rows_written = 0
         
     def connect(self):
-        """Connect to PostgreSQL database"""
+        """Borrow a connection from the pool, creating tables once per process"""
+        global _schema_initialized
         try:
-            self.conn = psycopg2.connect(
-                host='database-1.cz1wx0qlnvul.us-east-1.rds.amazonaws.com',
-                database='postgres',
-                user='postgres',
-                password='HolyMolyZoly',
-                port='5432'
-            )
+            if not _pool_slots.acquire(timeout=POOL_WAIT_TIMEOUT):
+                raise psycopg2.pool.PoolError(
+                    f"no pooled connection free after {POOL_WAIT_TIMEOUT:.0f}s"
+                )
+            self._has_slot = True
+            pool = get_pool()
+            self.conn = pool.getconn()
+            if self.conn.closed:
+                # Server dropped this one while it sat in the pool
+                pool.putconn(self.conn, close=True)
+                self.conn = pool.getconn()
             print("Database connected")
-            self.initialize_database()
+            
+            with _pool_lock:
+                if not _schema_initialized:
+                    self.initialize_database()
+                    _schema_initialized = True
         except Exception as e:
+            self.close()
             print(f"Database connection failed: {e}")
             raise
     
@@ -63,77 +131,582 @@ class DatabaseManager:
                 )
             """)
             
+            # Every row belongs to a portfolio; single-portfolio runs use 'default'
+            for table in ('holdings', 'portfolio_snapshots', 'holdings_snapshot'):
+                cur.execute(f"""
+                    ALTER TABLE {table}
+                    ADD COLUMN IF NOT EXISTS portfolio_id VARCHAR(64) NOT NULL DEFAULT '{DEFAULT_PORTFOLIO_ID}'
+                """)
+            
+            # Hash of the ETL inputs behind each snapshot, to skip unchanged re-runs
+            cur.execute("""
+                ALTER TABLE portfolio_snapshots
+                ADD COLUMN IF NOT EXISTS input_fingerprint VARCHAR(64)
+            """)
+            
+            # Natural key for holdings: repeated tickers are numbered lots 0, 1, ...
+            cur.execute("""
+                ALTER TABLE holdings
+                ADD COLUMN IF NOT EXISTS lot INTEGER NOT NULL DEFAULT 0
+            """)
+            cur.execute("""
+                UPDATE holdings h
+                SET lot = numbered.lot
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY portfolio_id, ticker ORDER BY id) - 1 AS lot
+                    FROM holdings
+                ) numbered
+                WHERE h.id = numbered.id AND h.lot <> numbered.lot
+            """)
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_holdings_natural_key
+                ON holdings (portfolio_id, ticker, lot)
+            """)
+            
+            # Portfolio P&L for history charts; older rows leave it NULL
+            cur.execute("""
+                ALTER TABLE portfolio_snapshots
+                ADD COLUMN IF NOT EXISTS total_unrealized_pnl DECIMAL(15,2)
+            """)
+            
+            # Each holdings_snapshot row points at the portfolio_snapshots row it belongs to
+            cur.execute("""
+                ALTER TABLE holdings_snapshot
+                ADD COLUMN IF NOT EXISTS snapshot_id INTEGER REFERENCES portfolio_snapshots (id)
+            """)
+            
+            # Access paths for per-portfolio and per-snapshot reads
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_holdings_portfolio
+                ON holdings (portfolio_id)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_portfolio_snapshots_portfolio_date
+                ON portfolio_snapshots (portfolio_id, snapshot_date DESC)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_holdings_snapshot_snapshot
+                ON holdings_snapshot (snapshot_id)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_holdings_snapshot_portfolio_ticker_date
+                ON holdings_snapshot (portfolio_id, ticker, snapshot_date DESC)
+            """)
+            
+            # Latest-snapshot pointers, maintained on every save so the dashboard
+            # never has to search the append-only history
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS latest_snapshot (
+                    portfolio_id VARCHAR(64) PRIMARY KEY,
+                    snapshot_id INTEGER NOT NULL REFERENCES portfolio_snapshots (id),
+                    snapshot_date TIMESTAMP NOT NULL
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS latest_holdings (
+                    portfolio_id VARCHAR(64) NOT NULL,
+                    ticker VARCHAR(10) NOT NULL,
+                    snapshot_id INTEGER NOT NULL REFERENCES portfolio_snapshots (id),
+                    snapshot_date TIMESTAMP NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    current_price DECIMAL(10,2) NOT NULL,
+                    market_value DECIMAL(15,2) NOT NULL,
+                    unrealized_pnl DECIMAL(15,2) NOT NULL,
+                    PRIMARY KEY (portfolio_id, ticker)
+                )
+            """)
+            
+            # Link rows written before snapshot_id existed, and seed the pointers from them
+            cur.execute("""
+                UPDATE holdings_snapshot hs
+                SET snapshot_id = ps.id
+                FROM portfolio_snapshots ps
+                WHERE hs.snapshot_id IS NULL
+                  AND ps.portfolio_id = hs.portfolio_id
+                  AND ps.snapshot_date = hs.snapshot_date
+            """)
+            cur.execute("""
+                INSERT INTO latest_snapshot (portfolio_id, snapshot_id, snapshot_date)
+                SELECT DISTINCT ON (portfolio_id) portfolio_id, id, snapshot_date
+                FROM portfolio_snapshots
+                ORDER BY portfolio_id, snapshot_date DESC
+                ON CONFLICT (portfolio_id) DO NOTHING
+            """)
+            cur.execute("""
+                SELECT snapshot_id FROM latest_snapshot
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM latest_holdings lh WHERE lh.portfolio_id = latest_snapshot.portfolio_id
+                )
+            """)
+            unseeded = [row[0] for row in cur.fetchall()]
+            if unseeded:
+                self._refresh_latest_pointers(cur, unseeded, full=True)
+            
         self.conn.commit()
         print("All database tables created")
 
-    def save_initial_holdings(self, portfolio_df):
-        """Save the original portfolio holdings to database"""
+    def _copy_frame(self, cur, table, frame):
+        """Stream a frame into table with a single COPY FROM STDIN"""
+        buffer = io.StringIO()
+        frame.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.copy_expert(
+            f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        self.round_trips += 1
+        self.rows_written += len(frame)
+
+    def _execute(self, cur, sql, params=None):
+        """Execute one statement on the write path, counting the round-trip"""
+        cur.execute(sql, params)
+        self.round_trips += 1
+
+    def _refresh_latest_pointers(self, cur, snapshot_ids, full=True):
+        """Point latest_snapshot and latest_holdings at newly written snapshots.
+
+        Lots of the same ticker are summed into one latest_holdings row. With
+        full=True the snapshots cover every position, so tickers they do not
+        mention are dropped from latest_holdings. Older snapshots (e.g. from a
+        backfill) never move the pointers backwards.
+        """
+        self._execute(cur, """
+            INSERT INTO latest_snapshot (portfolio_id, snapshot_id, snapshot_date)
+            SELECT portfolio_id, id, snapshot_date FROM portfolio_snapshots WHERE id = ANY(%s)
+            ON CONFLICT (portfolio_id) DO UPDATE
+            SET snapshot_id = excluded.snapshot_id, snapshot_date = excluded.snapshot_date
+            WHERE excluded.snapshot_date >= latest_snapshot.snapshot_date
+        """, (snapshot_ids,))
+        self._execute(cur, """
+            INSERT INTO latest_holdings
+            (portfolio_id, ticker, snapshot_id, snapshot_date, quantity, current_price, market_value, unrealized_pnl)
+            SELECT hs.portfolio_id, hs.ticker, hs.snapshot_id, MAX(hs.snapshot_date), SUM(hs.quantity),
+                   MAX(hs.current_price), SUM(hs.market_value), SUM(hs.unrealized_pnl)
+            FROM holdings_snapshot hs
+            -- Only snapshots the pointer now names; an older one must not add tickers either
+            JOIN latest_snapshot ls
+              ON ls.portfolio_id = hs.portfolio_id AND ls.snapshot_id = hs.snapshot_id
+            WHERE hs.snapshot_id = ANY(%s)
+            GROUP BY hs.portfolio_id, hs.ticker, hs.snapshot_id
+            ON CONFLICT (portfolio_id, ticker) DO UPDATE
+            SET snapshot_id = excluded.snapshot_id,
+                snapshot_date = excluded.snapshot_date,
+                quantity = excluded.quantity,
+                current_price = excluded.current_price,
+                market_value = excluded.market_value,
+                unrealized_pnl = excluded.unrealized_pnl
+            WHERE excluded.snapshot_date >= latest_holdings.snapshot_date
+        """, (snapshot_ids,))
+        if full:
+            self._execute(cur, """
+                DELETE FROM latest_holdings lh
+                USING latest_snapshot ls
+                WHERE ls.portfolio_id = lh.portfolio_id
+                  AND ls.snapshot_id = ANY(%s)
+                  AND lh.snapshot_date < ls.snapshot_date
+            """, (snapshot_ids,))
+
+    def _holdings_rows(self, portfolio_df, portfolio_id):
+        """Rows for the holdings table; each repeat of a ticker is the next lot"""
+        return pd.DataFrame({
+            'portfolio_id': portfolio_id,
+            'ticker': portfolio_df['Ticker'].astype(str),
+            'lot': portfolio_df.groupby('Ticker').cumcount().astype(int),
+            'quantity': portfolio_df['Quantity'].astype(int),
+            'purchase_price': portfolio_df['PurchasePrice'].astype(float)
+        })
+
+    def _snapshot_row(self, portfolio_metrics, portfolio_id):
+        """Row for the portfolio_snapshots table"""
+        return {
+            'portfolio_id': portfolio_id,
+            'snapshot_date': portfolio_metrics['timestamp'],
+            'total_value': float(portfolio_metrics['total_market_value']),
+            'total_unrealized_pnl': float(portfolio_metrics['total_unrealized_pnl']),
+            'total_return': float(portfolio_metrics['total_return_percent']),
+            'volatility': float(portfolio_metrics['volatility']),
+            'sharpe_ratio': float(portfolio_metrics['sharpe_ratio']),
+            'input_fingerprint': portfolio_metrics.get('input_fingerprint')
+        }
+
+    def _holdings_snapshot_rows(self, portfolio_details, portfolio_metrics, portfolio_id, snapshot_id):
+        """Rows for the holdings_snapshot table; unpriced holdings have no value to record"""
+        if 'PriceMissing' in portfolio_details:
+            missing = portfolio_details['PriceMissing'].to_numpy(dtype=bool)
+            if missing.any():
+                print(f"Skipping {missing.sum()} holdings without a price")
+            portfolio_details = portfolio_details[~missing]
+        return pd.DataFrame({
+            'portfolio_id': portfolio_id,
+            'snapshot_id': snapshot_id,
+            'snapshot_date': portfolio_metrics['timestamp'],
+            'ticker': portfolio_details['Ticker'].astype(str),
+            'quantity': portfolio_details['Quantity'].astype(int),
+            'current_price': portfolio_details['CurrentPrice'].astype(float),
+            'market_value': portfolio_details['MarketValue'].astype(float),
+            'unrealized_pnl': portfolio_details['UnrealizedPnl'].astype(float)
+        })
+
+    def _sync_holdings(self, cur, rows, portfolio_ids):
+        """Make the stored holdings of portfolio_ids equal rows, in one statement.
+
+        Lots are matched on (portfolio_id, ticker, lot); only new, changed and
+        removed lots are written, so an unchanged portfolio writes nothing.
+        Returns the number of rows inserted, updated or deleted.
+        """
+        self._execute(cur, """
+            WITH incoming AS (
+                SELECT *
+                FROM unnest(
+                    %(portfolio_id)s::varchar[], %(ticker)s::varchar[], %(lot)s::integer[],
+                    %(quantity)s::integer[], %(purchase_price)s::decimal(10,2)[]
+                ) AS t (portfolio_id, ticker, lot, quantity, purchase_price)
+            ), upserted AS (
+                INSERT INTO holdings (portfolio_id, ticker, lot, quantity, purchase_price)
+                SELECT portfolio_id, ticker, lot, quantity, purchase_price FROM incoming
+                ON CONFLICT (portfolio_id, ticker, lot) DO UPDATE
+                SET quantity = excluded.quantity, purchase_price = excluded.purchase_price
+                WHERE (holdings.quantity, holdings.purchase_price)
+                      IS DISTINCT FROM (excluded.quantity, excluded.purchase_price)
+                RETURNING 1
+            ), deleted AS (
+                DELETE FROM holdings h
+                WHERE h.portfolio_id = ANY(%(portfolio_ids)s)
+                  AND NOT EXISTS (
+                    SELECT 1 FROM incoming i
+                    WHERE i.portfolio_id = h.portfolio_id AND i.ticker = h.ticker AND i.lot = h.lot
+                  )
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM upserted) + (SELECT COUNT(*) FROM deleted)
+        """, {
+            **{column: rows[column].tolist() for column in rows.columns},
+            'portfolio_ids': list(portfolio_ids)
+        })
+        changed = cur.fetchone()[0]
+        self.rows_written += changed
+        return changed
+    
+    def save_initial_holdings(self, portfolio_df, portfolio_id=DEFAULT_PORTFOLIO_ID, mode='sync'):
+        """Save the original portfolio holdings to database.
+
+        mode='sync' writes only the lots that differ from what is stored;
+        mode='replace' deletes the portfolio's holdings and reloads them all.
+        """
+        if mode not in HOLDINGS_SAVE_MODES:
+            raise ValueError(f"Unknown holdings save mode: {mode}")
         try:
             with self.conn.cursor() as cur:
-                # Clear existing holdings (optional)
-                cur.execute("DELETE FROM holdings")
-                
-                # Insert current portfolio
-                for _, holding in portfolio_df.iterrows():
-                    cur.execute("""
-                        INSERT INTO holdings (ticker, quantity, purchase_price)
-                        VALUES (%s, %s, %s)
-                    """, (
-                        str(holding['Ticker']),
-                        int(holding['Quantity']),
-                        float(holding['PurchasePrice'])
-                    ))
+                rows = self._holdings_rows(portfolio_df, portfolio_id)
+                if mode == 'sync':
+                    changed = self._sync_holdings(cur, rows, [portfolio_id])
+                else:
+                    # Clear existing holdings
+                    self._execute(cur, "DELETE FROM holdings WHERE portfolio_id = %s", (portfolio_id,))
+                    
+                    # Insert current portfolio
+                    self._copy_frame(cur, 'holdings', rows)
+                    changed = len(rows)
                 
             self.conn.commit()
-            print("Initial holdings saved to database")
+            self.round_trips += 1
+            print(f"Initial holdings saved to database ({changed} rows changed)")
             
         except Exception as e:
             self.conn.rollback()
             print(f"Failed to save initial holdings: {e}")
             raise
     
-    def save_portfolio_snapshot(self, portfolio_details, portfolio_metrics):
-        """Save current portfolio state to database"""
+    def _insert_snapshots(self, cur, rows):
+        """Insert portfolio_snapshots rows in one statement; return {portfolio_id: snapshot id}"""
+        columns = list(rows[0])
+        returned = execute_values(cur, f"""
+            INSERT INTO portfolio_snapshots ({', '.join(columns)})
+            VALUES %s
+            RETURNING portfolio_id, id
+        """, [tuple(row[c] for c in columns) for row in rows], page_size=len(rows), fetch=True)
+        self.round_trips += 1
+        self.rows_written += len(rows)
+        return dict(returned)
+    
+    def save_portfolio_snapshot(self, portfolio_details, portfolio_metrics,
+                                portfolio_id=DEFAULT_PORTFOLIO_ID, partial=False):
+        """Save current portfolio state to database.
+
+        partial=True means portfolio_details only holds the positions that
+        changed, so positions missing from it keep their latest values.
+        Returns False without writing when the metrics carry the same input
+        fingerprint as the portfolio's latest snapshot.
+        """
+        fingerprint = portfolio_metrics.get('input_fingerprint')
+        if fingerprint is not None and fingerprint == self.get_latest_fingerprint(portfolio_id):
+            print("Inputs unchanged since the latest snapshot; nothing saved")
+            return False
         try:
             with self.conn.cursor() as cur:
-                # Save portfolio summary - convert ALL values to native Python types
-                cur.execute("""
-                    INSERT INTO portfolio_snapshots 
-                    (snapshot_date, total_value, total_return, volatility, sharpe_ratio)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    portfolio_metrics['timestamp'],
-                    float(portfolio_metrics['total_market_value']),
-                    float(portfolio_metrics['total_return_percent']),
-                    float(portfolio_metrics['volatility']),
-                    float(portfolio_metrics['sharpe_ratio'])
-                ))
+                # Save portfolio summary
+                snapshot_ids = self._insert_snapshots(
+                    cur, [self._snapshot_row(portfolio_metrics, portfolio_id)]
+                )
                 
                 # Save individual holdings
-                for _, holding in portfolio_details.iterrows():
-                    cur.execute("""
-                        INSERT INTO holdings_snapshot 
-                        (snapshot_date, ticker, quantity, current_price, market_value, unrealized_pnl)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (
-                        portfolio_metrics['timestamp'],
-                        str(holding['Ticker']),
-                        int(holding['Quantity']),
-                        float(holding['CurrentPrice']),
-                        float(holding['MarketValue']),
-                        float(holding['UnrealizedPnl'])
-                    ))
+                self._copy_frame(cur, 'holdings_snapshot', self._holdings_snapshot_rows(
+                    portfolio_details, portfolio_metrics, portfolio_id, snapshot_ids[portfolio_id]
+                ))
+                self._refresh_latest_pointers(cur, list(snapshot_ids.values()), full=not partial)
                 
             self.conn.commit()
+            self.round_trips += 1
             print("Portfolio snapshot saved to database")
+            return True
             
         except Exception as e:
             self.conn.rollback()
             print(f"Failed to save snapshot: {e}")
             raise
     
+    def save_batch(self, results):
+        """Bulk-load holdings and snapshots for many portfolios in one transaction.
+
+        results is a list of (portfolio_id, portfolio_details, portfolio_metrics).
+        """
+        if not results:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                portfolio_ids = [portfolio_id for portfolio_id, _, _ in results]
+                self._sync_holdings(cur, pd.concat([
+                    self._holdings_rows(details, portfolio_id)
+                    for portfolio_id, details, _ in results
+                ], ignore_index=True), portfolio_ids)
+                
+                snapshot_ids = self._insert_snapshots(cur, [
+                    self._snapshot_row(metrics, portfolio_id)
+                    for portfolio_id, _, metrics in results
+                ])
+                self._copy_frame(cur, 'holdings_snapshot', pd.concat([
+                    self._holdings_snapshot_rows(details, metrics, portfolio_id, snapshot_ids[portfolio_id])
+                    for portfolio_id, details, metrics in results
+                ], ignore_index=True))
+                self._refresh_latest_pointers(cur, list(snapshot_ids.values()), full=True)
+                
+            self.conn.commit()
+            self.round_trips += 1
+            print(f"Snapshots for {len(results)} portfolios saved to database")
+            
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to save batch: {e}")
+            raise
+    
+    def save_backfill(self, snapshots, holdings_snapshots, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Replace the snapshots at the given snapshot_dates with recomputed ones, in one transaction.
+
+        snapshots has one portfolio_snapshots row per snapshot_date;
+        holdings_snapshots has the matching holdings_snapshot rows. Re-running
+        with the same dates replaces rather than duplicates, and snapshots at
+        other times (e.g. live runs) are left alone. The latest pointers only
+        move if the newest backfilled snapshot is newer than what they hold.
+        """
+        if snapshots.empty:
+            return
+        dates = [timestamp.to_pydatetime() for timestamp in pd.to_datetime(snapshots['snapshot_date'])]
+        try:
+            with self.conn.cursor() as cur:
+                # Drop earlier copies of these snapshots, unhooking any pointer at them first
+                self._execute(cur, """
+                    SELECT id FROM portfolio_snapshots
+                    WHERE portfolio_id = %s AND snapshot_date = ANY(%s)
+                """, (portfolio_id, dates))
+                replaced = [row[0] for row in cur.fetchall()]
+                if replaced:
+                    self._execute(cur, "DELETE FROM latest_holdings WHERE snapshot_id = ANY(%s)", (replaced,))
+                    self._execute(cur, "DELETE FROM latest_snapshot WHERE snapshot_id = ANY(%s)", (replaced,))
+                    self._execute(cur, """
+                        DELETE FROM holdings_snapshot
+                        WHERE portfolio_id = %s AND (snapshot_id = ANY(%s) OR snapshot_date = ANY(%s))
+                    """, (portfolio_id, replaced, dates))
+                    self._execute(cur, "DELETE FROM portfolio_snapshots WHERE id = ANY(%s)", (replaced,))
+                
+                self._copy_frame(cur, 'portfolio_snapshots', snapshots.assign(portfolio_id=portfolio_id))
+                self._execute(cur, """
+                    SELECT snapshot_date, id FROM portfolio_snapshots
+                    WHERE portfolio_id = %s AND snapshot_date = ANY(%s)
+                """, (portfolio_id, dates))
+                snapshot_ids = pd.Series(dict(cur.fetchall()))
+                snapshot_ids.index = pd.to_datetime(snapshot_ids.index)
+                
+                holdings_snapshots = holdings_snapshots.assign(
+                    portfolio_id=portfolio_id,
+                    snapshot_id=snapshot_ids.reindex(pd.to_datetime(holdings_snapshots['snapshot_date'])).to_numpy()
+                )
+                self._copy_frame(cur, 'holdings_snapshot', holdings_snapshots)
+                self._refresh_latest_pointers(cur, [int(snapshot_ids.sort_index().iloc[-1])], full=True)
+                
+            self.conn.commit()
+            self.round_trips += 1
+            print(f"Backfilled {len(snapshots)} snapshots ({len(replaced)} replaced)")
+            
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to save backfill: {e}")
+            raise
+    
+    def begin_streamed_snapshot(self, portfolio_df, timestamp, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Open a snapshot whose holdings arrive in chunks; return its snapshot id.
+
+        Syncs the holdings and inserts a placeholder portfolio_snapshots row.
+        Nothing is committed until finish_streamed_snapshot, so readers never
+        see a partial snapshot.
+        """
+        try:
+            with self.conn.cursor() as cur:
+                self._sync_holdings(cur, self._holdings_rows(portfolio_df, portfolio_id), [portfolio_id])
+                self._execute(cur, """
+                    INSERT INTO portfolio_snapshots (portfolio_id, snapshot_date, total_value)
+                    VALUES (%s, %s, 0)
+                    RETURNING id
+                """, (portfolio_id, timestamp))
+                return cur.fetchone()[0]
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to start snapshot: {e}")
+            raise
+    
+    def write_streamed_holdings(self, snapshot_id, portfolio_details, timestamp,
+                                portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """COPY one chunk of valued holdings into an open streamed snapshot"""
+        try:
+            with self.conn.cursor() as cur:
+                self._copy_frame(cur, 'holdings_snapshot', self._holdings_snapshot_rows(
+                    portfolio_details, {'timestamp': timestamp}, portfolio_id, snapshot_id
+                ))
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to write snapshot holdings: {e}")
+            raise
+    
+    def finish_streamed_snapshot(self, snapshot_id, portfolio_metrics, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Fill in the placeholder row, move the latest pointers and commit.
+
+        Like save_portfolio_snapshot, returns False and rolls the streamed
+        snapshot back when its input fingerprint matches the latest snapshot's.
+        """
+        fingerprint = portfolio_metrics.get('input_fingerprint')
+        if fingerprint is not None and fingerprint == self.get_latest_fingerprint(portfolio_id):
+            # Same inputs, so the holdings sync in this transaction changed nothing either
+            self.conn.rollback()
+            print("Inputs unchanged since the latest snapshot; nothing saved")
+            return False
+        try:
+            with self.conn.cursor() as cur:
+                row = self._snapshot_row(portfolio_metrics, portfolio_id)
+                self._execute(cur, f"""
+                    UPDATE portfolio_snapshots
+                    SET {', '.join(f'{column} = %s' for column in row)}
+                    WHERE id = %s
+                """, list(row.values()) + [snapshot_id])
+                self.rows_written += 1
+                self._refresh_latest_pointers(cur, [snapshot_id], full=True)
+                
+            self.conn.commit()
+            self.round_trips += 1
+            print("Streamed portfolio snapshot saved to database")
+            return True
+            
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to finish snapshot: {e}")
+            raise
+    
+    def get_latest_metrics(self, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Latest (total_value, total_return, volatility, sharpe_ratio) via the latest-snapshot pointer"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT ps.total_value, ps.total_return, ps.volatility, ps.sharpe_ratio
+                FROM latest_snapshot ls
+                JOIN portfolio_snapshots ps ON ps.id = ls.snapshot_id
+                WHERE ls.portfolio_id = %s
+            """, (portfolio_id,))
+            return cur.fetchone()
+    
+    def get_latest_fingerprint(self, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Input fingerprint of the portfolio's latest snapshot (None if unknown)"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT ps.input_fingerprint
+                FROM latest_snapshot ls
+                JOIN portfolio_snapshots ps ON ps.id = ls.snapshot_id
+                WHERE ls.portfolio_id = %s
+            """, (portfolio_id,))
+            row = cur.fetchone()
+            self.round_trips += 1
+        return row[0] if row else None
+    
+    def get_latest_allocation(self, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Latest market value per ticker, read from latest_holdings"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT ticker, market_value
+                FROM latest_holdings
+                WHERE portfolio_id = %s
+                ORDER BY market_value DESC
+            """, (portfolio_id,))
+            return pd.DataFrame(cur.fetchall(), columns=['Ticker', 'Value'])
+    
+    def get_portfolio_history(self, portfolio_id=DEFAULT_PORTFOLIO_ID, start=None, end=None,
+                              points=HISTORY_POINTS):
+        """Portfolio value/P&L series over [start, end], at most `points` rows.
+
+        Snapshots are averaged into points * HISTORY_PREAGGREGATION time buckets
+        in the database, so the payload stays bounded however long the range
+        is; LTTB then picks the points that best keep the value curve's shape.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                WITH snapshots AS (
+                    SELECT EXTRACT(EPOCH FROM snapshot_date) AS epoch,
+                           total_value, total_unrealized_pnl, total_return
+                    FROM portfolio_snapshots
+                    WHERE portfolio_id = %(portfolio_id)s
+                      AND snapshot_date >= COALESCE(%(start)s, '-infinity'::timestamp)
+                      AND snapshot_date <= COALESCE(%(end)s, 'infinity'::timestamp)
+                ), bounds AS (
+                    SELECT MIN(epoch) AS lo,
+                           GREATEST((MAX(epoch) - MIN(epoch)) / %(buckets)s, 1) AS width
+                    FROM snapshots
+                )
+                SELECT to_timestamp(AVG(epoch)) AT TIME ZONE 'UTC',
+                       AVG(total_value), AVG(total_unrealized_pnl), AVG(total_return), COUNT(*)
+                FROM snapshots, bounds
+                GROUP BY FLOOR((epoch - lo) / width)
+                ORDER BY 1
+            """, {
+                'portfolio_id': portfolio_id,
+                'start': start,
+                'end': end,
+                'buckets': points * HISTORY_PREAGGREGATION
+            })
+            history = pd.DataFrame(cur.fetchall(), columns=[
+                'snapshot_date', 'total_value', 'total_unrealized_pnl', 'total_return', 'snapshots'
+            ])
+        
+        for column in ('total_value', 'total_unrealized_pnl', 'total_return'):
+            history[column] = pd.to_numeric(history[column], errors='coerce').astype(float)
+        history['snapshot_date'] = pd.to_datetime(history['snapshot_date'])
+        
+        keep = lttb(history['snapshot_date'].astype('int64'), history['total_value'], points)
+        return history.iloc[keep].reset_index(drop=True)
+    
     def close(self):
-        """Close database connection"""
+        """Return the connection to the pool"""
         if self.conn:
-            self.conn.close()
-            print("Database connection closed")
+            if self.conn.closed:
+                get_pool().putconn(self.conn, close=True)
+            else:
+                get_pool().putconn(self.conn)
+            self.conn = None
+            print("Database connection released")
+        if self._has_slot:
+            self._has_slot = False
+            _pool_slots.release()
@@ -1,103 +1,335 @@
+import cProfile
+import hashlib
+import os
+import pstats
 import pandas as pd
-import yfinance as yf
 from datetime import datetime, timedelta
 import numpy as np
+from price_store import PriceStore
+from market_data import get_provider
+from valuation import value_holdings, summarize
+from rolling_metrics import RollingReturns
+from risk import get_risk_engine
+from instrumentation import RunMetrics
+from holdings_store import get_holdings_store
+
+# Price source for a ticker whose fetch failed and that is valued at its last known close
+FALLBACK_SOURCE = 'fallback'
 
 class PortfolioETL:
-    def __init__(self):
+    def __init__(self, portfolio_path=None, price_store=None, provider=None, single_fetch=True,
+                 max_staleness_days=1, intraday_refresh=False,
+                 metrics_mode='full', rolling_returns=None, verify_metrics=False,
+                 profile_transform=None, memo_path='etl_memo.pkl'):
+        # Holdings come from this CSV when given, otherwise from the shared holdings store
+        self.portfolio_path = portfolio_path
         self.portfolio_df = None
-        self.price_data = None
+        self.price_data = None        # current price per ticker
+        self.price_sources = None     # where each current price came from
         self.historical_data = None
+        self.risk_model = None        # covariance model of the last full metrics pass
+        self.risk_contributions = None
+        # Take current prices from the last row of history instead of a second request
+        self.single_fetch = single_fetch
+        # Closes older than this many business days are refreshed with an intraday quote
+        self.max_staleness_days = max_staleness_days
+        # Refresh every ticker with an intraday quote, not just the stale ones
+        self.intraday_refresh = intraday_refresh
+        # Local cache of daily closes so each run only fetches missing days
+        # (created on first extract, so transform-only instances don't open it)
+        self.price_store = price_store
+        # Chunked, concurrent market data source (see market_data.get_provider)
+        self.provider = provider
+        # 'full' recomputes risk metrics from the whole year; 'incremental' extends
+        # persisted rolling aggregates and only prices today's session
+        self.metrics_mode = metrics_mode
+        self.rolling_returns = rolling_returns
+        # In incremental mode, also run the full recompute and report the difference
+        self.verify_metrics = verify_metrics
+        # Per-stage timings and counters for the current run
+        self.run_metrics = RunMetrics()
+        # Write a cProfile dump of transform to this path
+        self.profile_transform = profile_transform
+        # Result of the last run, reused while its input fingerprint still matches (None disables)
+        self.memo_path = memo_path
+        self.input_fingerprint = None
+        # Tickers the provider did not return in this run (their prices are fallbacks)
+        self.failed_tickers = set()
+        
+    def _download_close(self, tickers, **kwargs):
+        """Fetch a Close frame through the provider, counting what was asked for and returned"""
+        try:
+            close_data = self.provider.download_close(tickers, **kwargs)
+        except Exception:
+            self.failed_tickers.update(tickers)
+            raise
+        returned = set(close_data.dropna(axis=1, how='all').columns)
+        # A later request (e.g. an intraday quote) that returns the ticker clears the failure
+        self.failed_tickers.update(set(tickers) - returned)
+        self.failed_tickers.difference_update(returned)
+        self.run_metrics.increment('provider_requests')
+        self.run_metrics.increment('tickers_requested', len(tickers))
+        self.run_metrics.increment('tickers_returned', close_data.shape[1])
+        # In-memory size of the returned frame, as a proxy for payload size
+        self.run_metrics.increment('bytes_fetched', int(close_data.memory_usage(deep=True).sum()))
+        return close_data
+        
+    def _load_history(self, tickers, compact=True, window_start=None):
+        """Fetch only the days missing from the price store, then read 1 year back (or from window_start)"""
+        if window_start is None:
+            window_start = pd.Timestamp.today().normalize() - pd.DateOffset(years=1)
+        if self.price_store is None:
+            self.price_store = PriceStore()
+        
+        for start, group in self.price_store.missing_ranges(tickers, window_start).items():
+            print(f"Fetching history from {start} for {len(group)} tickers")
+            try:
+                repriced = self.price_store.save(self._download_close(group, start=start), window_start)
+                if repriced:
+                    # A split or dividend re-adjusted these upstream; the stored closes are
+                    # only swapped out once the whole window has been fetched again
+                    print(f"Adjusted closes changed for {len(repriced)} tickers; re-fetching their history")
+                    self.price_store.save(
+                        self._download_close(repriced, start=window_start), window_start, replace=repriced
+                    )
+            except Exception as e:
+                # Carry on with what the store already has; those prices are flagged as fallbacks
+                print(f"History fetch failed, using stored closes: {e}")
+        
+        if compact:
+            self.price_store.compact()
+        return self.price_store.load(tickers, window_start)
+    
+    def _spot_prices(self, tickers, historical_data=None):
+        """Derive current prices from the history, refreshing stale ones with an intraday quote"""
+        tickers = list(dict.fromkeys(tickers))
+        if historical_data is None:
+            historical_data = self.historical_data
+        history = historical_data.reindex(columns=tickers)
+        prices = pd.Series(np.nan, index=tickers)
+        age = pd.Series(np.nan, index=tickers)
         
+        if len(history):
+            prices = history.ffill().iloc[-1]
+            # Date of the last close per ticker (cumsum peaks at the last non-NaN row)
+            has_close = history.notna()
+            last_dates = has_close.cumsum().idxmax().where(has_close.any())
+            dated = last_dates.notna()
+            today = np.datetime64(datetime.now().date(), 'D')
+            age[dated] = np.busday_count(
+                last_dates[dated].to_numpy(dtype='datetime64[D]'), today
+            )
+        
+        sources = pd.Series('history', index=prices.index)
+        sources[age > self.max_staleness_days] = 'history_stale'
+        sources[prices.isna()] = 'missing'
+        
+        refresh = tickers if self.intraday_refresh else sources.index[sources != 'history'].tolist()
+        if refresh:
+            print(f"Fetching intraday quotes for {len(refresh)} tickers")
+            try:
+                quotes = self._download_close(refresh, period="1d")
+            except Exception as e:
+                print(f"Intraday quote fetch failed: {e}")
+                quotes = pd.DataFrame()
+            if not quotes.empty:
+                quotes = quotes.ffill().iloc[-1].dropna()
+                prices[quotes.index] = quotes
+                sources[quotes.index] = 'intraday'
+        
+        self._mark_fallbacks(prices, sources)
+        return prices, sources
+    
+    def _mark_fallbacks(self, prices, sources):
+        """Flag priced tickers whose latest fetch failed: they carry their last known price"""
+        failed = sources.index.isin(list(self.failed_tickers)) & prices.reindex(sources.index).notna().to_numpy()
+        sources[failed] = FALLBACK_SOURCE
+        
+    def read_holdings(self):
+        """Read portfolio holdings from the CSV or the holdings store"""
+        if self.portfolio_path:
+            self.portfolio_df = pd.read_csv(self.portfolio_path)
+        else:
+            self.portfolio_df = get_holdings_store().load()
+        print("Portfolio data extracted")
+        return self.portfolio_df
+    
     def extract(self):
         """Extract portfolio data, current prices, and historical data"""
         try:
-            # Read portfolio from CSV
-            self.portfolio_df = pd.read_csv('portfolio.csv')
-            print("Portfolio data extracted")
+            self.read_holdings()
             
-            # Get current prices
-            tickers = self.portfolio_df['Ticker'].tolist()
-            print(f"Fetching prices for: {tickers}")
+            self.extract_prices(self.portfolio_df['Ticker'].tolist())
+            
+        except Exception as e:
+            print(f"Extraction failed: {e}")
+            raise
+    
+    def extract_prices(self, tickers):
+        """Extract current prices and historical data for tickers"""
+        try:
+            if self.provider is None:
+                self.provider = get_provider()
+            self.failed_tickers = set()
             
-            # Add auto_adjust=True to fix the warning
-            self.price_data = yf.download(tickers, period="1d", auto_adjust=True)['Close']
-            print("Current price data extracted")
+            # Get current prices
+            print(f"Fetching prices for {len(tickers)} tickers")
             
             # Get historical data for volatility calculations (1 year)
-            self.historical_data = yf.download(tickers, period="1y", auto_adjust=True)['Close']
+            self.historical_data = self._load_history(tickers)
             print("Historical (1 year) data extracted")
             
+            if self.single_fetch:
+                self.price_data, self.price_sources = self._spot_prices(tickers)
+            else:
+                quotes = self._download_close(tickers, period="1d")
+                latest = quotes.ffill().iloc[-1] if len(quotes) else pd.Series(dtype=float)
+                self.price_data = latest.reindex(tickers)
+                self.price_sources = pd.Series('intraday', index=self.price_data.index)
+                # Fall back to the last stored close for tickers the quote request missed
+                unquoted = self.price_data.isna()
+                if len(self.historical_data):
+                    last_close = self.historical_data.ffill().iloc[-1].reindex(tickers)
+                    self.price_data = self.price_data.fillna(last_close)
+                    self.price_sources[unquoted & self.price_data.notna()] = FALLBACK_SOURCE
+                self.price_sources[self.price_data.isna()] = 'missing'
+            
+            counts = self.price_sources.value_counts()
+            print("Current price data extracted (" + 
+                  ", ".join(f"{source}={count}" for source, count in counts.items()) + ")")
+            
         except Exception as e:
-            print(f"Extraction failed: {e}")
+            print(f"Price extraction failed: {e}")
             raise
     
+    def refresh_quotes(self, tickers):
+        """Overlay one intraday quote request onto already extracted prices"""
+        try:
+            quotes = self._download_close(tickers, period="1d")
+        except Exception as e:
+            print(f"Intraday quote fetch failed: {e}")
+            quotes = pd.DataFrame()
+        if quotes.empty:
+            self._mark_fallbacks(self.price_data, self.price_sources)
+            return
+        latest = quotes.ffill().iloc[-1].dropna()
+        self.price_data[latest.index] = latest
+        self.price_sources[latest.index] = 'intraday'
+        # Tickers this request missed keep the previous price, which is now stale
+        self._mark_fallbacks(self.price_data, self.price_sources)
+        
+        # Keep the quote's session row of history current so the metrics see it in progress.
+        # Dated by the quote, not the clock: on weekends and holidays it is the last session
+        session = pd.Timestamp(quotes.index[-1]).normalize()
+        self.historical_data.loc[session, latest.index] = latest.to_numpy()
+        if not self.historical_data.index.is_monotonic_increasing:
+            self.historical_data.sort_index(inplace=True)
+    
+    def _portfolio_weights(self, historical_data):
+        """Weights based on current market value"""
+        current_prices = historical_data.iloc[-1]
+        quantities = self.portfolio_df.groupby('Ticker')['Quantity'].sum()
+        portfolio_values = current_prices * quantities.reindex(current_prices.index)
+        return portfolio_values / portfolio_values.sum()
+    
     def calculate_portfolio_metrics(self):
         """Calculate advanced portfolio metrics"""
+        if self.metrics_mode != 'incremental':
+            return self._full_metrics()
+        
+        metrics = self._incremental_metrics()
+        if self.verify_metrics:
+            full = self._full_metrics()
+            print("Metrics check (incremental vs full): " + ", ".join(
+                f"{name} {metrics[name]:.4f} vs {full[name]:.4f}" for name in metrics
+            ))
+        return metrics
+    
+    def _incremental_metrics(self):
+        """Risk metrics from persisted rolling aggregates"""
+        if self.rolling_returns is None:
+            self.rolling_returns = RollingReturns()
+        
+        historical_data = self.historical_data.dropna(axis=1, how='all')
+        weights = self._portfolio_weights(historical_data)
+        
+        # Today's row is still moving; only completed sessions go into the window
+        today = pd.Timestamp.today().normalize()
+        completed = historical_data[historical_data.index < today]
+        
+        rolling = self.rolling_returns
+        if rolling.needs_rebuild(weights, completed):
+            print("Rebuilding rolling return window from full history")
+            rolling.rebuild(completed, weights)
+        else:
+            added = rolling.update(completed)
+            print(f"Rolling return window extended by {added} days")
+        rolling.save()
+        
+        current_prices = None
+        if historical_data.index[-1] >= today:
+            current_prices = historical_data.iloc[-1]
+        return rolling.metrics(current_prices)
+    
+    def _full_metrics(self):
+        """Recompute risk metrics from the full year of history"""
+        # Tickers without any price history carry no weight (see valuation)
+        historical_data = self.historical_data.dropna(axis=1, how='all')
+        
         # Calculate daily returns for each stock
-        daily_returns = self.historical_data.pct_change().dropna()
+        daily_returns = historical_data.pct_change().dropna()
         
         # Create portfolio weights based on current market value
-        current_prices = self.historical_data.iloc[-1]
-        portfolio_values = current_prices * self.portfolio_df.set_index('Ticker')['Quantity']
-        weights = portfolio_values / portfolio_values.sum()
+        weights = self._portfolio_weights(historical_data)
         
         # Calculate portfolio daily returns
         portfolio_daily_returns = (daily_returns * weights).sum(axis=1)
-        
-        # Calculate metrics
         total_return = (portfolio_daily_returns + 1).prod() - 1
-        volatility = portfolio_daily_returns.std() * np.sqrt(252)  # Annualized
-        sharpe_ratio = (portfolio_daily_returns.mean() * 252) / (portfolio_daily_returns.std() * np.sqrt(252))
+        
+        # Volatility as sqrt(w' Σ w); Σ is cached until the price history changes
+        self.risk_model = get_risk_engine().model(historical_data)
+        volatility = self.risk_model.portfolio_volatility(weights)  # Annualized
+        sharpe_ratio = self.risk_model.expected_return(weights) / volatility
+        self.risk_contributions = self.risk_model.risk_contributions(weights)
         
         return {
             'total_return': total_return * 100,  # as percentage
             'volatility': volatility * 100,      # as percentage
-            'sharpe_ratio': sharpe_ratio
+            'sharpe_ratio': sharpe_ratio,
+            # 1-day 95% parametric VaR, as a percentage of market value
+            'value_at_risk': self.risk_model.parametric_var(weights, 100)
         }
     
     def transform(self):
         """Transform data and calculate metrics"""
         try:
-            # Calculate current values (your existing code)
-            self.portfolio_df['CurrentPrice'] = self.portfolio_df['Ticker'].map(
-                lambda x: self.price_data[x].iloc[-1] if x in self.price_data.columns else 0
-            )
-            
-            self.portfolio_df['MarketValue'] = (
-                self.portfolio_df['Quantity'] * self.portfolio_df['CurrentPrice']
-            )
-            
-            self.portfolio_df['CostBasis'] = (
-                self.portfolio_df['Quantity'] * self.portfolio_df['PurchasePrice']
-            )
-            
-            self.portfolio_df['UnrealizedPnl'] = (
-                self.portfolio_df['MarketValue'] - self.portfolio_df['CostBasis']
-            )
-            
-            self.portfolio_df['UnrealizedPnlPercent'] = (
-                (self.portfolio_df['UnrealizedPnl'] / self.portfolio_df['CostBasis']) * 100
+            # Value every holding in one vectorized pass
+            self.portfolio_df = value_holdings(self.portfolio_df, self.price_data)
+            self.portfolio_df['PriceSource'] = (
+                self.price_sources.reindex(self.portfolio_df['Ticker']).fillna('missing').to_numpy()
             )
+            self.portfolio_df['PriceStale'] = (self.portfolio_df['PriceSource'] == FALLBACK_SOURCE).to_numpy()
             
             # Calculate portfolio totals
-            total_market_value = self.portfolio_df['MarketValue'].sum()
-            total_cost_basis = self.portfolio_df['CostBasis'].sum()
-            total_pnl = total_market_value - total_cost_basis
-            total_return_pct = (total_pnl / total_cost_basis) * 100
+            totals = summarize(self.portfolio_df)
+            if totals['missing_prices']:
+                print(f"No price for {totals['missing_prices']} holdings; excluded from totals")
+            stale = int(self.portfolio_df['PriceStale'].sum())
+            if stale:
+                print(f"{stale} holdings valued at their last known price")
+                self.run_metrics.increment('stale_prices', stale)
             
             # Calculate advanced metrics
-            advanced_metrics = self.calculate_portfolio_metrics()
+            with self.run_metrics.stage('metrics'):
+                advanced_metrics = self.calculate_portfolio_metrics()
             
             portfolio_metrics = {
                 'timestamp': datetime.now(),
-                'total_market_value': total_market_value,
-                'total_cost_basis': total_cost_basis,
-                'total_unrealized_pnl': total_pnl,
-                'total_return_percent': total_return_pct,
+                **totals,
                 'volatility': advanced_metrics['volatility'],
                 'sharpe_ratio': advanced_metrics['sharpe_ratio'],
-                'annual_return': advanced_metrics['total_return']
+                'annual_return': advanced_metrics['total_return'],
+                'value_at_risk': advanced_metrics.get('value_at_risk', np.nan)
             }
             
             print("Data transformation completed")
@@ -107,10 +339,90 @@ class PortfolioETL:
             print(f"Transformation failed: {e}")
             raise
     
+    def _profiled_transform(self):
+        """Run transform under cProfile and dump the stats to profile_transform"""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self.transform()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self.profile_transform)
+            print(f"Transform profile written to {self.profile_transform}")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(10)
+    
+    def _price_hashes(self, price_data, price_sources, historical_data):
+        """Per-ticker row hashes of the latest price, its source and the date of the last close"""
+        # Last row with a close per ticker (all-NaN columns hash as the first row)
+        history = historical_data
+        last_dates = history.notna().iloc[::-1].idxmax() if len(history) else pd.Series(dtype=object)
+        return [
+            pd.util.hash_pandas_object(part, index=True).to_numpy()
+            for part in (price_data, price_sources, last_dates)
+        ]
+    
+    def fingerprint_inputs(self, price_hashes=None):
+        """Hash of the holdings plus each ticker's latest price and the date of its last close.
+
+        price_hashes are _price_hashes() arrays; row hashes concatenate, so
+        chunks hashed in ticker order give the same fingerprint as one pass.
+        """
+        holdings = self.portfolio_df[['Ticker', 'Quantity', 'PurchasePrice']]
+        if price_hashes is None:
+            price_hashes = self._price_hashes(self.price_data, self.price_sources, self.historical_data)
+        
+        digest = hashlib.sha256(self.metrics_mode.encode())
+        digest.update(pd.util.hash_pandas_object(holdings, index=False).to_numpy().tobytes())
+        for part in price_hashes:
+            digest.update(part.tobytes())
+        return digest.hexdigest()
+    
+    def _load_memo(self, fingerprint):
+        """(portfolio_details, portfolio_metrics) memoized for this fingerprint, or None"""
+        if not self.memo_path or not os.path.exists(self.memo_path):
+            return None
+        try:
+            memo = pd.read_pickle(self.memo_path)
+        except Exception as e:
+            print(f"Ignoring unreadable ETL memo: {e}")
+            return None
+        if memo.get('fingerprint') != fingerprint:
+            return None
+        return memo['portfolio_details'], memo['portfolio_metrics']
+    
+    def _save_memo(self, fingerprint, portfolio_details, portfolio_metrics):
+        tmp_path = self.memo_path + '.tmp'
+        pd.to_pickle({
+            'fingerprint': fingerprint,
+            'portfolio_details': portfolio_details,
+            'portfolio_metrics': portfolio_metrics
+        }, tmp_path)
+        os.replace(tmp_path, self.memo_path)
+    
     def run(self):
         """Execute the complete ETL pipeline"""
-        self.extract()
-        portfolio_details, portfolio_metrics = self.transform()
+        with self.run_metrics.stage('extract'):
+            self.extract()
+        
+        # Same holdings and prices as the last run: its results still hold
+        self.input_fingerprint = self.fingerprint_inputs()
+        memo = self._load_memo(self.input_fingerprint)
+        if memo is not None:
+            portfolio_details, portfolio_metrics = memo
+            self.portfolio_df = portfolio_details
+            self.run_metrics.outcome = 'no_change'
+            print("Inputs unchanged since the last run; reusing its results")
+        else:
+            with self.run_metrics.stage('transform'):
+                if self.profile_transform:
+                    portfolio_details, portfolio_metrics = self._profiled_transform()
+                else:
+                    portfolio_details, portfolio_metrics = self.transform()
+            portfolio_metrics['input_fingerprint'] = self.input_fingerprint
+            if self.memo_path:
+                self._save_memo(self.input_fingerprint, portfolio_details, portfolio_metrics)
+            self.run_metrics.outcome = 'updated'
+        self.run_metrics.increment('holdings', len(portfolio_details))
         
         print(f"Portfolio Value: ${portfolio_metrics['total_market_value']:,.2f}")
         print(f"Total Return: {portfolio_metrics['total_return_percent']:.2f}%")
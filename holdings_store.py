@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+HOLDINGS_COLUMNS = ['Ticker', 'Quantity', 'PurchasePrice']
+# Writers from other processes wait this long for the lock instead of failing
+BUSY_TIMEOUT_MS = 5000
+
+
+class HoldingsStore:
+    """Portfolio holdings in SQLite, shared safely by the dashboard, ETL and daemon.
+
+    Each row is one lot; adding a ticker that is already held appends another
+    lot, as appending to portfolio.csv did. Writes are single transactions under
+    SQLite's file lock, and every write bumps a version counter so readers can
+    tell cheaply whether anything changed.
+    """
+
+    def __init__(self, path='holdings.db', csv_path='portfolio.csv'):
+        self.path = path
+        self.csv_path = csv_path  # imported once if the store starts out empty
+        # Autocommit mode; writes open their own BEGIN IMMEDIATE transaction
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                    timeout=BUSY_TIMEOUT_MS / 1000)
+        self._lock = threading.RLock()  # one connection shared by this process's threads
+        self._cached = (None, None)  # (version, frame) of the last load
+        self.initialize()
+
+    def initialize(self):
+        """Create holdings tables and import the legacy CSV on first use"""
+        # WAL lets readers carry on while another process writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        with self._transaction():
+            # One row per lot; id keeps insertion order
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS holdings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ticker TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    purchase_price REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_holdings_ticker ON holdings (ticker)")
+
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+
+            version = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            if version == 0 and self.csv_path and os.path.exists(self.csv_path):
+                self._replace(pd.read_csv(self.csv_path))
+                print(f"Holdings imported from {self.csv_path}")
+
+    @contextmanager
+    def _transaction(self):
+        """One write transaction, taking SQLite's write lock up front"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _bump_version(self):
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def _replace(self, holdings_df):
+        """Replace every lot (inside a transaction)"""
+        self.conn.execute("DELETE FROM holdings")
+        self.conn.executemany(
+            "INSERT INTO holdings (ticker, quantity, purchase_price) VALUES (?, ?, ?)",
+            [
+                (str(ticker).upper(), int(quantity), float(price))
+                for ticker, quantity, price in holdings_df[HOLDINGS_COLUMNS].itertuples(index=False)
+            ]
+        )
+        self._bump_version()
+
+    def version(self):
+        """Counter that changes on every write, from any process"""
+        with self._lock:
+            return self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def load(self):
+        """All lots as a Ticker/Quantity/PurchasePrice frame, in the order they were added"""
+        with self._lock:
+            version = self.version()
+            if self._cached[0] != version:
+                holdings_df = pd.read_sql_query(
+                    "SELECT ticker, quantity, purchase_price FROM holdings ORDER BY id", self.conn
+                )
+                holdings_df.columns = HOLDINGS_COLUMNS
+                self._cached = (version, holdings_df)
+            return self._cached[1].copy()
+
+    def add(self, ticker, quantity, purchase_price):
+        """Add a lot"""
+        with self._transaction():
+            self.conn.execute(
+                "INSERT INTO holdings (ticker, quantity, purchase_price) VALUES (?, ?, ?)",
+                (ticker.upper(), int(quantity), float(purchase_price))
+            )
+            self._bump_version()
+
+    def update(self, ticker, quantity, purchase_price, lot=0):
+        """Change one lot of ticker (lots are numbered from 0 in the order they were added)"""
+        with self._transaction():
+            updated = self.conn.execute("""
+                UPDATE holdings SET quantity = ?, purchase_price = ?
+                WHERE id = (SELECT id FROM holdings WHERE ticker = ? ORDER BY id LIMIT 1 OFFSET ?)
+            """, (int(quantity), float(purchase_price), ticker.upper(), lot)).rowcount
+            if not updated:
+                raise KeyError(f"{ticker} has no lot {lot}")
+            self._bump_version()
+
+    def remove(self, ticker):
+        """Delete every lot of ticker; return how many were removed"""
+        with self._transaction():
+            removed = self.conn.execute(
+                "DELETE FROM holdings WHERE ticker = ?", (ticker.upper(),)
+            ).rowcount
+            if removed:
+                self._bump_version()
+        return removed
+
+    def import_csv(self, path):
+        """Replace the holdings with the contents of a portfolio CSV"""
+        holdings_df = pd.read_csv(path)
+        with self._transaction():
+            self._replace(holdings_df)
+        return len(holdings_df)
+
+    def export_csv(self, path):
+        """Write the holdings to a portfolio CSV (atomically)"""
+        tmp_path = path + '.tmp'
+        self.load().to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        """Close the store"""
+        self.conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_holdings_store():
+    """Return the process-wide holdings store (path from HOLDINGS_DB)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HoldingsStore(os.environ.get('HOLDINGS_DB', 'holdings.db'))
+        return _store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import or export holdings as portfolio CSV")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('csv_path', nargs='?', default='portfolio.csv')
+    args = parser.parse_args()
+
+    store = get_holdings_store()
+    if args.action == 'import':
+        print(f"Imported {store.import_csv(args.csv_path)} lots from {args.csv_path}")
+    else:
+        store.export_csv(args.csv_path)
+        print(f"Exported holdings to {args.csv_path}")
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+METRIC_PREFIX = 'portfolio_etl'
+
+
+class RunMetrics:
+    """Per-stage timings and counters for one ETL run.
+
+    stage() records wall and CPU time for a block; increment() adds to named
+    counters (tickers_requested, tickers_returned, bytes_fetched, rows_written,
+    db_round_trips, ...). Counters are safe to update from provider threads.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.counters = {}
+        self.outcome = None  # 'updated', or 'no_change' when the inputs matched the last run
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as a named stage"""
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            # CPU time is process-wide, so it includes worker threads
+            with self._lock:
+                totals = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+                totals['wall_seconds'] += time.perf_counter() - wall_start
+                totals['cpu_seconds'] += time.process_time() - cpu_start
+
+    def increment(self, name, value=1):
+        """Add value to a named counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(),
+                'stages': {name: dict(totals) for name, totals in self.stages.items()},
+                'counters': dict(self.counters),
+                'outcome': self.outcome,
+            }
+
+    def log_json(self):
+        """Print the run as one structured JSON log line"""
+        print(json.dumps({'event': 'etl_run', **self.to_dict()}, default=float))
+
+    def write_prometheus(self, path):
+        """Write a node_exporter textfile-collector file (atomically)"""
+        data = self.to_dict()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_wall_seconds Wall time per ETL stage",
+            f"# TYPE {METRIC_PREFIX}_stage_wall_seconds gauge",
+        ]
+        lines += [
+            f'{METRIC_PREFIX}_stage_wall_seconds{{stage="{name}"}} {totals["wall_seconds"]:.6f}'
+            for name, totals in data['stages'].items()
+        ]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_stage_cpu_seconds CPU time per ETL stage",
+            f"# TYPE {METRIC_PREFIX}_stage_cpu_seconds gauge",
+        ]
+        lines += [
+            f'{METRIC_PREFIX}_stage_cpu_seconds{{stage="{name}"}} {totals["cpu_seconds"]:.6f}'
+            for name, totals in data['stages'].items()
+        ]
+        for name, value in data['counters'].items():
+            lines += [
+                f"# TYPE {METRIC_PREFIX}_{name} gauge",
+                f"{METRIC_PREFIX}_{name} {value}",
+            ]
+        if self.outcome is not None:
+            lines += [
+                f"# HELP {METRIC_PREFIX}_last_run_unchanged 1 if the last run found no input changes",
+                f"# TYPE {METRIC_PREFIX}_last_run_unchanged gauge",
+                f"{METRIC_PREFIX}_last_run_unchanged {int(self.outcome == 'no_change')}",
+            ]
+        lines += [
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds {self.started_at.timestamp():.0f}",
+        ]
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
@@ -0,0 +1,464 @@
+import os
+import random
+import threading
+import time
+import zlib
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+DEFAULT_CHUNK_SIZE = 25
+DEFAULT_MAX_WORKERS = 8
+# Latency bounds (seconds). Request budgets are a fixed part plus a part per
+# ticker in the request, so they fit a single symbol and a full chunk alike
+DEFAULT_REQUEST_TIMEOUT = 5      # per attempt...
+DEFAULT_TICKER_TIMEOUT = 0.5     # ...plus this per ticker
+DEFAULT_HEDGE_AFTER = 2          # send a duplicate request once the first is this slow...
+DEFAULT_TICKER_HEDGE_AFTER = 0.2 # ...plus this per ticker
+DEFAULT_CALL_DEADLINE = 60       # per chunk, across splits and retries
+DEFAULT_FETCH_DEADLINE = 90      # per wave of chunks in flight, so it grows with the book
+DEFAULT_RETRIES = 2              # extra attempts for a ticker whose request failed on its own
+DEFAULT_BACKOFF = 0.5            # base of the jittered exponential backoff
+# Per-ticker circuit breaker: stop asking for a symbol after this many
+# consecutive failures, until the cooldown has passed
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 300
+# Timeout yfinance applies to each of its HTTP requests
+YAHOO_TIMEOUT = 10
+
+# yfinance-style period strings accepted by every provider
+PERIOD_OFFSETS = {
+    '1d': pd.DateOffset(days=1),
+    '5d': pd.DateOffset(days=5),
+    '1mo': pd.DateOffset(months=1),
+    '3mo': pd.DateOffset(months=3),
+    '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1),
+    '2y': pd.DateOffset(years=2),
+    '5y': pd.DateOffset(years=5),
+}
+
+
+def _normalize_close(close_data):
+    """Return a Close frame indexed by tz-naive trading dates"""
+    index = pd.to_datetime(close_data.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    close_data = close_data.set_axis(index.normalize(), axis=0)
+    close_data.index.name = 'Date'
+    close_data.columns.name = None
+    # Several rows can land on one date (e.g. intraday + close); keep the latest
+    return close_data[~close_data.index.duplicated(keep='last')].sort_index()
+
+
+class MarketDataProvider:
+    """Base class for price sources.
+
+    Providers return a wide Close frame (dates x tickers). Tickers that could
+    not be fetched are left out of the frame. concurrent is False for
+    providers that serialise their requests, where parallel chunks and hedged
+    duplicates would only queue behind each other.
+    """
+
+    concurrent = True
+
+    def download_close(self, tickers, period=None, start=None, end=None):
+        raise NotImplementedError
+
+
+class YahooProvider(MarketDataProvider):
+    """Yahoo Finance provider fetching each request as one batched yf.download.
+
+    yf.download keeps its results in module-level state, so calls are
+    serialised behind a lock; within a call yfinance fetches the tickers on
+    its own threads, each HTTP request bounded by YAHOO_TIMEOUT. A chunk is
+    therefore one upstream request, which is what ChunkedProvider's chunk size
+    and ResilientProvider's per-ticker timeouts are sized for.
+    """
+
+    concurrent = False
+    _download_lock = threading.Lock()
+
+    def download_close(self, tickers, period=None, start=None, end=None):
+        tickers = list(tickers)
+        if not tickers:
+            return pd.DataFrame()
+        kwargs = {'start': start, 'end': end} if start is not None else {'period': period or '1y'}
+        with self._download_lock:
+            data = yf.download(tickers, auto_adjust=True, progress=False, threads=True,
+                               timeout=YAHOO_TIMEOUT, **kwargs)
+        if data is None or data.empty:
+            return pd.DataFrame()
+
+        close_data = data['Close']
+        if isinstance(close_data, pd.Series):
+            close_data = close_data.to_frame(name=tickers[0])
+        # Tickers yfinance could not fetch come back as all-NaN columns
+        close_data = close_data.dropna(axis=1, how='all')
+        if close_data.empty:
+            return pd.DataFrame()
+        return _normalize_close(close_data)
+
+
+class FakeProvider(MarketDataProvider):
+    """Deterministic offline provider for tests and load testing.
+
+    Each ticker gets a smooth synthetic price curve seeded from its name, so
+    the same (ticker, date) always has the same close regardless of the window
+    requested. latency simulates per-request network time and fail_tickers
+    simulates symbols the upstream rejects.
+    """
+
+    def __init__(self, latency=0.0, fail_tickers=None):
+        self.latency = latency
+        self.fail_tickers = set(fail_tickers or [])
+
+    def download_close(self, tickers, period=None, start=None, end=None):
+        if self.latency:
+            time.sleep(self.latency)
+
+        tickers = [t for t in tickers if t not in self.fail_tickers]
+
+        end = pd.Timestamp(end).normalize() if end is not None else pd.Timestamp.today().normalize()
+        if start is not None:
+            start = pd.Timestamp(start).normalize()
+        elif period == '1d':
+            # Last trading day, even when today is a weekend
+            start = end - pd.DateOffset(days=7)
+        else:
+            start = end - PERIOD_OFFSETS[period or '1y']
+        dates = pd.bdate_range(start, end)
+        if period == '1d':
+            dates = dates[-1:]
+        if not tickers or dates.empty:
+            return pd.DataFrame(index=dates, columns=tickers, dtype=float)
+
+        seeds = np.array([zlib.crc32(t.encode()) for t in tickers], dtype=np.float64)
+        base = 20 + seeds % 480
+        phase = seeds % 628 / 100
+        drift = (seeds % 41 - 20) / 1e5
+        days = (dates - pd.Timestamp('2000-01-03')).days.to_numpy(dtype=np.float64)[:, None]
+
+        log_move = (
+            drift * days
+            + 0.15 * np.sin(days / 60 + phase)
+            + 0.05 * np.sin(days / 7 + 2 * phase)
+            + 0.01 * np.sin(days * 12.9898 + seeds) # day-to-day noise
+        )
+        close_data = pd.DataFrame(base * np.exp(log_move), index=dates, columns=tickers)
+        close_data.index.name = 'Date'
+        return close_data
+
+
+class _ProviderBusy(TimeoutError):
+    """A serialised provider was still busy with an earlier request when the deadline passed"""
+
+
+class ResilientProvider(MarketDataProvider):
+    """Bounds how long a request to the wrapped provider can take.
+
+    For a concurrent provider, each request gets a timeout sized to the
+    number of tickers in it and a hedged duplicate once it is slow. A request
+    that fails or times out is split in half and the halves are retried, so
+    one hung symbol doesn't take the rest of its chunk with it. A symbol whose
+    request fails on its own gets a few retries with jittered exponential
+    backoff; one that a successful response simply leaves out is not retried.
+    Everything stops at the call's deadline.
+
+    A provider that serialises requests can't start the next one until the
+    last has returned, so abandoning a slow one gains nothing: requests go
+    out one at a time and are waited on until the deadline (the provider's
+    own timeout bounds them). One still running then is left to finish
+    before this provider sends anything else, and groups that never got sent
+    because of it are neither split nor blamed.
+
+    Only a ticker that failed on its own counts towards its circuit breaker,
+    which then skips the symbol until the cooldown has passed. Attempts that
+    overrun are abandoned (threads cannot be killed) and finish in the
+    background on a shared pool.
+    """
+
+    def __init__(self, provider, timeout=DEFAULT_REQUEST_TIMEOUT, ticker_timeout=DEFAULT_TICKER_TIMEOUT,
+                 deadline=DEFAULT_CALL_DEADLINE, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 hedge_after=DEFAULT_HEDGE_AFTER, ticker_hedge_after=DEFAULT_TICKER_HEDGE_AFTER,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN, max_workers=32):
+        self.provider = provider
+        self.concurrent = provider.concurrent
+        self.timeout = timeout
+        self.ticker_timeout = ticker_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        # None disables hedging; it never helps a provider that serialises requests
+        self.hedge_after = hedge_after if provider.concurrent else None
+        self.ticker_hedge_after = ticker_hedge_after
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedges = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='market-data')
+        self._failures = {}    # ticker -> consecutive calls where it failed on its own
+        self._open_until = {}  # ticker -> monotonic time its breaker closes again
+        self._lock = threading.Lock()
+        # Serialised providers: one request at a time, abandoned ones included
+        self._lane = threading.Lock()
+        self._inflight = set()
+
+    def _closed(self, tickers, now):
+        """Tickers whose breaker lets a request through"""
+        with self._lock:
+            return [t for t in tickers if self._open_until.get(t, 0) <= now]
+
+    def _record(self, returned, failed):
+        """Reset breakers of returned tickers; count a failure against those that failed alone"""
+        now = time.monotonic()
+        opened = []
+        with self._lock:
+            for ticker in returned:
+                self._failures.pop(ticker, None)
+                self._open_until.pop(ticker, None)
+            for ticker in failed:
+                failures = self._failures[ticker] = self._failures.get(ticker, 0) + 1
+                if failures >= self.failure_threshold:
+                    # Half-open after the cooldown: the next call tries once more
+                    self._open_until[ticker] = now + self.cooldown
+                    opened.append(ticker)
+        if opened:
+            print(f"Circuit open for {len(opened)} tickers for {self.cooldown}s: {', '.join(opened[:10])}")
+
+    def _submit(self, group, kwargs):
+        future = self._pool.submit(self.provider.download_close, group, **kwargs)
+        if not self.concurrent:
+            self._inflight.add(future)
+        return future
+
+    def _round(self, groups, deadline_at, kwargs):
+        """Request each group at once (hedged); return a frame or an exception per group"""
+        now = time.monotonic()
+        attempts = []
+        for group in groups:
+            attempts.append({
+                'pending': {self._submit(group, kwargs)},
+                'expires': (min(now + self.timeout + self.ticker_timeout * len(group), deadline_at)
+                            if self.concurrent else deadline_at),
+                'hedge_at': (now + self.hedge_after + self.ticker_hedge_after * len(group)
+                             if self.hedge_after is not None else None),
+                'error': None,
+            })
+        results = [None] * len(groups)
+
+        while any(result is None for result in results):
+            now = time.monotonic()
+            for i, attempt in enumerate(attempts):
+                if results[i] is not None:
+                    continue
+                if now >= attempt['expires']:
+                    results[i] = TimeoutError(f"no response for {len(groups[i])} tickers in time")
+                elif attempt['hedge_at'] is not None and now >= attempt['hedge_at'] and attempt['pending']:
+                    attempt['hedge_at'] = None
+                    self.hedges += 1
+                    attempt['pending'].add(self._submit(groups[i], kwargs))
+            active = [i for i, result in enumerate(results) if result is None]
+            if not active:
+                break
+
+            # Sleep until a response arrives or the next timeout or hedge is due
+            events = [attempts[i]['expires'] for i in active]
+            events += [attempts[i]['hedge_at'] for i in active if attempts[i]['hedge_at'] is not None]
+            pending = set().union(*(attempts[i]['pending'] for i in active))
+            done, _ = wait(pending, timeout=max(min(events) - now, 0), return_when=FIRST_COMPLETED)
+
+            for i in active:
+                attempt = attempts[i]
+                for future in attempt['pending'] & done:
+                    attempt['pending'].discard(future)
+                    try:
+                        results[i] = future.result()
+                        break
+                    except Exception as e:
+                        attempt['error'] = e
+                # Every request for this group failed and no hedge is still to come
+                if results[i] is None and not attempt['pending']:
+                    results[i] = attempt['error']
+        return results
+
+    def _serial_request(self, group, deadline_at, kwargs):
+        """One request to a serialising provider, sent once it is free and waited on until the deadline"""
+        if not self._lane.acquire(timeout=max(deadline_at - time.monotonic(), 0)):
+            return _ProviderBusy("provider busy until the deadline")
+        try:
+            # A request abandoned at an earlier deadline still holds the provider
+            self._inflight = {future for future in self._inflight if not future.done()}
+            if self._inflight:
+                _, busy = wait(self._inflight, timeout=max(deadline_at - time.monotonic(), 0))
+                if busy:
+                    return _ProviderBusy("provider busy until the deadline")
+            return self._round([group], deadline_at, kwargs)[0]
+        finally:
+            self._lane.release()
+
+    def download_close(self, tickers, period=None, start=None, end=None):
+        tickers = list(dict.fromkeys(tickers))
+        kwargs = {'period': period, 'start': start, 'end': end}
+        started = time.monotonic()
+        deadline_at = started + self.deadline
+
+        requested = self._closed(tickers, started)
+        if len(requested) < len(tickers):
+            print(f"Skipping {len(tickers) - len(requested)} tickers with an open circuit")
+
+        frames = []
+        failed = []       # tickers that failed on their own
+        solo_tries = {}   # ticker -> failed requests made with it alone
+        groups = [requested] if requested else []
+        while groups and time.monotonic() < deadline_at:
+            retry_round = max((solo_tries.get(group[0], 0) for group in groups if len(group) == 1), default=0)
+            if retry_round:
+                # Full jitter, so retries from concurrent chunks don't arrive together
+                delay = random.uniform(0, self.backoff * 2 ** (retry_round - 1))
+                if time.monotonic() + delay >= deadline_at:
+                    break
+                time.sleep(delay)
+
+            if self.concurrent:
+                results = self._round(groups, deadline_at, kwargs)
+            else:
+                results = [self._serial_request(group, deadline_at, kwargs) for group in groups]
+
+            next_groups = []
+            for group, result in zip(groups, results):
+                if isinstance(result, _ProviderBusy):
+                    # Never sent: the deadline has passed, so this ends the loop
+                    next_groups.append(group)
+                    continue
+                errored = isinstance(result, Exception)
+                if errored:
+                    missing = group
+                    print(f"Request for {len(group)} tickers failed: {result}")
+                else:
+                    close_data = result.dropna(axis=1, how='all')
+                    got = [t for t in group if t in close_data.columns]
+                    if got:
+                        frames.append(close_data[got])
+                    missing = [t for t in group if t not in close_data.columns]
+
+                if len(missing) > 1:
+                    half = (len(missing) + 1) // 2
+                    next_groups += [missing[:half], missing[half:]]
+                elif missing and len(group) > 1:
+                    next_groups.append(missing)  # isolate it
+                elif missing and not errored:
+                    failed.append(missing[0])    # a clean "no data" answer; retrying won't change it
+                elif missing:
+                    ticker = missing[0]
+                    solo_tries[ticker] = solo_tries.get(ticker, 0) + 1
+                    if solo_tries[ticker] <= self.retries:
+                        next_groups.append(missing)
+                    else:
+                        failed.append(ticker)
+            groups = next_groups
+
+        returned = [t for frame in frames for t in frame.columns]
+        # At the deadline, only tickers whose own request already failed count as
+        # failed; the rest of the unfinished groups were never isolated
+        failed += [group[0] for group in groups if len(group) == 1 and solo_tries.get(group[0])]
+        self._record(returned, failed)
+        if not frames:
+            return pd.DataFrame()
+        return _normalize_close(pd.concat(frames, axis=1))
+
+
+class ChunkedProvider(MarketDataProvider):
+    """Splits a ticker list into chunks and fetches them on a bounded thread pool.
+
+    A chunk that fails only drops its own tickers; the rest of the frame is
+    still returned. With a deadline (seconds per wave of max_workers chunks,
+    so it scales with the book), chunks still outstanding when it passes are
+    dropped too. Each call starts from a different chunk, so a deadline that
+    does cut in doesn't drop the same tickers on every run.
+    """
+
+    def __init__(self, provider, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                 deadline=None):
+        self.provider = provider
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self._rotation = 0
+
+    def download_close(self, tickers, period=None, start=None, end=None):
+        tickers = list(dict.fromkeys(tickers))
+        chunks = [tickers[i:i + self.chunk_size] for i in range(0, len(tickers), self.chunk_size)]
+
+        if chunks:
+            offset = self._rotation % len(chunks)
+            self._rotation += 1
+            chunks = chunks[offset:] + chunks[:offset]
+
+        frames = []
+        # A provider that serialises requests gains nothing from parallel chunks
+        workers = min(self.max_workers if self.provider.concurrent else 1, len(chunks) or 1)
+        deadline = self.deadline * -(-len(chunks) // workers) if self.deadline is not None else None
+        pool = ThreadPoolExecutor(max_workers=workers)
+        futures = {
+            pool.submit(self.provider.download_close, chunk, period=period, start=start, end=end): chunk
+            for chunk in chunks
+        }
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                chunk = futures[future]
+                try:
+                    frames.append(future.result())
+                except Exception as e:
+                    print(f"Failed to fetch chunk {chunk[0]}..{chunk[-1]}: {e}")
+        except FuturesTimeoutError:
+            late = sum(len(chunk) for future, chunk in futures.items() if not future.done())
+            print(f"Gave up on {late} tickers after {deadline}s")
+        finally:
+            # Don't wait for overrunning chunks; unstarted ones are cancelled
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            print(f"Could not fetch any of {len(tickers)} tickers")
+            return pd.DataFrame()
+        close_data = pd.concat(frames, axis=1).sort_index()
+
+        returned = [t for t in tickers if t in close_data.columns]
+        if len(returned) < len(tickers):
+            print(f"Could not fetch {len(tickers) - len(returned)} of {len(tickers)} tickers")
+        # Same column order as requested, minus whatever failed
+        return close_data.reindex(columns=returned)
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name=None, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=DEFAULT_MAX_WORKERS, resilient=True):
+    """Return the process-wide chunked provider named by MARKET_DATA_PROVIDER (yahoo or fake).
+
+    With resilient=True every chunk goes through ResilientProvider and the
+    whole call is bounded by DEFAULT_FETCH_DEADLINE. Providers are shared per
+    configuration, so circuit-breaker state carries over between ETL runs,
+    refresh jobs and the quote cache in one process.
+    """
+    name = name or os.environ.get('MARKET_DATA_PROVIDER', 'yahoo')
+    key = (name, chunk_size, max_workers, resilient)
+    with _providers_lock:
+        if key in _providers:
+            return _providers[key]
+        if name == 'fake':
+            provider = FakeProvider()
+        elif name == 'yahoo':
+            provider = YahooProvider()
+        else:
+            raise ValueError(f"Unknown market data provider: {name}")
+        if resilient:
+            provider = ChunkedProvider(ResilientProvider(provider), chunk_size=chunk_size,
+                                       max_workers=max_workers, deadline=DEFAULT_FETCH_DEADLINE)
+        else:
+            provider = ChunkedProvider(provider, chunk_size=chunk_size, max_workers=max_workers)
+        _providers[key] = provider
+        return provider
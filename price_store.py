@@ -0,0 +1,226 @@
+import sqlite3
+import pandas as pd
+from datetime import datetime, timedelta
+
+# SQLite limits the number of bound parameters per statement
+QUERY_CHUNK_SIZE = 500
+# Relative change in a stored, completed close that means upstream re-adjusted it
+ADJUSTMENT_TOLERANCE = 1e-4
+
+
+class PriceStore:
+    def __init__(self, path='price_history.db', retention_days=400, idle_days=30):
+        self.path = path
+        self.retention_days = retention_days  # keep this many days of closes
+        self.idle_days = idle_days            # drop tickers not requested for this long
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.initialize()
+
+    def initialize(self):
+        """Create price history tables"""
+        with self.conn:
+            # One row per (ticker, trading day)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS prices (
+                    ticker TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    close REAL NOT NULL,
+                    PRIMARY KEY (ticker, date)
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_prices_date ON prices (date)")
+
+            # What has been fetched per ticker, and when it was last requested
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    ticker TEXT PRIMARY KEY,
+                    first_date TEXT NOT NULL,
+                    last_date TEXT NOT NULL,
+                    last_used TEXT NOT NULL
+                )
+            """)
+
+    def _coverage(self, tickers):
+        """Return {ticker: (first_date, last_date, previous_date)} for stored tickers.
+
+        previous_date is the stored day before last_date (None if there is none).
+        """
+        coverage = {}
+        for i in range(0, len(tickers), QUERY_CHUNK_SIZE):
+            chunk = tickers[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f"""
+                SELECT c.ticker, c.first_date, c.last_date,
+                       (SELECT MAX(p.date) FROM prices p
+                        WHERE p.ticker = c.ticker AND p.date < c.last_date)
+                FROM coverage c WHERE c.ticker IN ({placeholders})
+            """, chunk).fetchall()
+            for ticker, first_date, last_date, previous_date in rows:
+                coverage[ticker] = (first_date, last_date, previous_date)
+        return coverage
+
+    def missing_ranges(self, tickers, window_start):
+        """Group tickers by the start date that still has to be fetched.
+
+        Tickers already covered from window_start are re-fetched from the day
+        before their last stored day, so a partial intraday close gets replaced
+        and save() has one completed close to check against upstream.
+        """
+        window_start = pd.Timestamp(window_start).strftime('%Y-%m-%d')
+        coverage = self._coverage(list(tickers))
+
+        ranges = {}
+        for ticker in tickers:
+            first_date, last_date, previous_date = coverage.get(ticker, (None, None, None))
+            if first_date is None or first_date > window_start:
+                start = window_start
+            else:
+                start = max(previous_date or last_date, window_start)
+            ranges.setdefault(start, []).append(ticker)
+        return ranges
+
+    def _repriced(self, rows):
+        """Tickers whose stored completed closes differ from the re-fetched ones.
+
+        Closes are split- and dividend-adjusted, so a corporate action upstream
+        rewrites every earlier close; the stored history is then inconsistent
+        with anything fetched from now on. The last stored day is skipped, as
+        it may have been a partial intraday close.
+        """
+        fetched = rows.rename('fetched').reset_index()
+        tickers = fetched['ticker'].unique().tolist()
+        frames = []
+        for i in range(0, len(tickers), QUERY_CHUNK_SIZE):
+            chunk = tickers[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            frames.append(pd.read_sql_query(f"""
+                SELECT p.ticker, p.date, p.close FROM prices p
+                JOIN coverage c ON c.ticker = p.ticker
+                WHERE p.ticker IN ({placeholders}) AND p.date >= ? AND p.date < c.last_date
+            """, self.conn, params=chunk + [fetched['date'].min()]))
+        stored = pd.concat(frames, ignore_index=True).merge(fetched, on=['ticker', 'date'])
+        changed = (stored['fetched'] - stored['close']).abs() > ADJUSTMENT_TOLERANCE * stored['close'].abs()
+        return stored.loc[changed, 'ticker'].unique().tolist()
+
+    def save(self, close_data, window_start, replace=()):
+        """Upsert a wide Close frame (dates x tickers) into the store.
+
+        Returns the tickers whose stored history no longer matches upstream
+        (see _repriced). Their new rows are not written, since splicing them
+        onto the old closes would be inconsistent; the caller should re-fetch
+        them from window_start and save that frame with replace=those tickers.
+        Tickers in replace that the frame has closes for get all their stored
+        rows swapped for the frame's in one transaction; the others keep theirs.
+        """
+        if close_data is None or close_data.empty:
+            return []
+
+        index = pd.to_datetime(close_data.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        close_data = close_data.set_axis(index.strftime('%Y-%m-%d'), axis=0)
+
+        rows = close_data.stack().dropna()
+        rows.index = rows.index.set_names(['date', 'ticker'])
+        row_tickers = rows.index.get_level_values('ticker')
+        replace = [t for t in dict.fromkeys(replace) if t in set(row_tickers)]
+        compared = rows[~row_tickers.isin(replace)]
+        repriced = self._repriced(compared) if len(compared) else []
+        if repriced:
+            rows = rows[~row_tickers.isin(repriced)]
+        records = [(ticker, date, float(close)) for (date, ticker), close in rows.items()]
+
+        window_start = pd.Timestamp(window_start).strftime('%Y-%m-%d')
+        today = datetime.now().strftime('%Y-%m-%d')
+        spans = rows.reset_index().groupby('ticker')['date'].agg(['min', 'max'])
+
+        with self.conn:
+            for i in range(0, len(replace), QUERY_CHUNK_SIZE):
+                chunk = replace[i:i + QUERY_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                self.conn.execute(f"DELETE FROM prices WHERE ticker IN ({placeholders})", chunk)
+                self.conn.execute(f"DELETE FROM coverage WHERE ticker IN ({placeholders})", chunk)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO prices (ticker, date, close) VALUES (?, ?, ?)",
+                records
+            )
+            # Coverage only ever widens: keep the earliest start and latest day seen
+            self.conn.executemany("""
+                INSERT INTO coverage (ticker, first_date, last_date, last_used)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (ticker) DO UPDATE SET
+                    first_date = MIN(first_date, excluded.first_date),
+                    last_date = MAX(last_date, excluded.last_date),
+                    last_used = excluded.last_used
+            """, [
+                (ticker, min(window_start, span['min']), span['max'], today)
+                for ticker, span in spans.iterrows()
+            ])
+        return repriced
+
+    def load(self, tickers, window_start):
+        """Load a wide Close frame (dates x tickers) from window_start onwards"""
+        # A ticker held in several lots must only be queried once
+        tickers = list(dict.fromkeys(tickers))
+        window_start = pd.Timestamp(window_start).strftime('%Y-%m-%d')
+        today = datetime.now().strftime('%Y-%m-%d')
+
+        frames = []
+        for i in range(0, len(tickers), QUERY_CHUNK_SIZE):
+            chunk = tickers[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            frames.append(pd.read_sql_query(
+                f"SELECT ticker, date, close FROM prices "
+                f"WHERE ticker IN ({placeholders}) AND date >= ?",
+                self.conn,
+                params=chunk + [window_start]
+            ))
+            with self.conn:
+                self.conn.execute(
+                    f"UPDATE coverage SET last_used = ? WHERE ticker IN ({placeholders})",
+                    [today] + chunk
+                )
+
+        rows = pd.concat(frames, ignore_index=True)
+        close_data = rows.pivot(index='date', columns='ticker', values='close')
+        close_data.index = pd.to_datetime(close_data.index)
+        close_data.index.name = 'Date'
+        close_data.columns.name = None
+        # Keep requested column order; tickers with no data come back as all-NaN
+        return close_data.reindex(columns=tickers).sort_index()
+
+    def compact(self):
+        """Evict closes older than the retention window and tickers no longer requested"""
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        idle_cutoff = (datetime.now() - timedelta(days=self.idle_days)).strftime('%Y-%m-%d')
+
+        with self.conn:
+            idle = [row[0] for row in self.conn.execute(
+                "SELECT ticker FROM coverage WHERE last_used < ?", (idle_cutoff,)
+            )]
+            removed = self.conn.execute("DELETE FROM prices WHERE date < ?", (cutoff,)).rowcount
+            for i in range(0, len(idle), QUERY_CHUNK_SIZE):
+                chunk = idle[i:i + QUERY_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                removed += self.conn.execute(
+                    f"DELETE FROM prices WHERE ticker IN ({placeholders})", chunk
+                ).rowcount
+                self.conn.execute(f"DELETE FROM coverage WHERE ticker IN ({placeholders})", chunk)
+            # Anything older than the cutoff is no longer covered
+            self.conn.execute(
+                "UPDATE coverage SET first_date = ? WHERE first_date < ?", (cutoff, cutoff)
+            )
+
+        # Only rewrite the file once a meaningful share of it is free pages
+        free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        total_pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        if total_pages and free_pages / total_pages > 0.25:
+            self.conn.execute("VACUUM")
+
+        if removed:
+            print(f"Price store compacted: {removed} rows, {len(idle)} idle tickers removed")
+        return removed
+
+    def close(self):
+        """Close the store"""
+        self.conn.close()
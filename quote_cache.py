@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from market_data import get_provider
+
+DEFAULT_TTL = float(os.environ.get('QUOTE_CACHE_TTL', '60'))
+
+
+class QuoteCache:
+    """Per-ticker cache of latest prices shared by every dashboard session.
+
+    Only tickers that are missing or older than ttl seconds are sent to the
+    provider. A ticker the provider could not price keeps its last good price,
+    flagged stale, for another ttl (or NaN if it never had one) so a bad
+    symbol is not re-requested on every render.
+    """
+
+    def __init__(self, provider=None, ttl=DEFAULT_TTL):
+        self.provider = provider if provider is not None else get_provider()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._quotes = {}                    # ticker -> (price, fetched_at)
+        self._stale = set()                  # tickers holding a last known price after a failed fetch
+        self._lock = threading.Lock()        # guards _quotes and counters
+        self._fetch_lock = threading.Lock()  # one provider request at a time
+
+    def _expired(self, tickers, now):
+        return [
+            t for t in tickers
+            if t not in self._quotes or now - self._quotes[t][1] > self.ttl
+        ]
+
+    def get_prices(self, tickers):
+        """Return a Series of latest prices indexed by ticker"""
+        tickers = list(dict.fromkeys(tickers))
+
+        with self._lock:
+            stale = self._expired(tickers, time.monotonic())
+            self.hits += len(tickers) - len(stale)
+            self.misses += len(stale)
+
+        if stale:
+            with self._fetch_lock:
+                # Another session may have refreshed these while we waited
+                with self._lock:
+                    stale = self._expired(stale, time.monotonic())
+                if stale:
+                    quotes = self.provider.download_close(stale, period="1d")
+                    latest = quotes.ffill().iloc[-1] if len(quotes) else pd.Series(dtype=float)
+                    fetched_at = time.monotonic()
+                    with self._lock:
+                        for ticker in stale:
+                            price = float(latest.get(ticker, np.nan))
+                            if np.isnan(price) and ticker in self._quotes:
+                                price = self._quotes[ticker][0]
+                                if not np.isnan(price):
+                                    self._stale.add(ticker)
+                            else:
+                                self._stale.discard(ticker)
+                            self._quotes[ticker] = (price, fetched_at)
+
+        with self._lock:
+            return pd.Series(
+                [self._quotes.get(t, (np.nan, None))[0] for t in tickers], index=tickers, dtype=float
+            )
+
+    def stale_tickers(self, tickers):
+        """Tickers among these currently priced at a last known (stale) price"""
+        with self._lock:
+            return [t for t in dict.fromkeys(tickers) if t in self._stale]
+
+    def invalidate(self, tickers=None):
+        """Drop cached quotes for tickers (or all of them)"""
+        with self._lock:
+            if tickers is None:
+                self._quotes.clear()
+                self._stale.clear()
+            else:
+                for ticker in tickers:
+                    self._quotes.pop(ticker, None)
+                    self._stale.discard(ticker)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._quotes),
+                'stale': len(self._stale),
+                'ttl': self.ttl,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_quote_cache():
+    """Return the process-wide quote cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QuoteCache()
+        return _cache
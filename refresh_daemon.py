@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import os
+import signal
+import time
+import numpy as np
+import pandas as pd
+from etl_pipeline import PortfolioETL
+from database import DatabaseManager, close_pool
+from holdings_store import get_holdings_store
+
+DEFAULT_INTERVAL = 60          # seconds between repricing passes
+DEFAULT_HISTORY_REFRESH = 3600  # seconds between incremental history pulls
+
+
+class RefreshDaemon:
+    """Long-running repricer that keeps the DB connection and price state warm.
+
+    Holdings are re-read only when the holdings store version (or, given a
+    portfolio CSV, its mtime) changes. Between history
+    pulls each pass fetches one intraday quote request, reprices with the
+    incremental metrics path, and writes holdings snapshot rows only for
+    positions whose price moved.
+    """
+
+    def __init__(self, portfolio_path=None, interval=DEFAULT_INTERVAL,
+                 history_refresh=DEFAULT_HISTORY_REFRESH):
+        self.portfolio_path = portfolio_path
+        self.interval = interval
+        self.history_refresh = history_refresh
+        self.etl = PortfolioETL(portfolio_path=portfolio_path, metrics_mode='incremental')
+        self.db = DatabaseManager()
+        self.holdings = None
+        self.last_prices = pd.Series(dtype=float)
+        self._holdings_stamp = None
+        self._history_loaded_at = None
+        self._stop = asyncio.Event()
+
+    def _reload_holdings(self):
+        """Re-read the holdings if they changed; return whether they did"""
+        if self.portfolio_path:
+            stamp = os.stat(self.portfolio_path).st_mtime_ns
+        else:
+            stamp = get_holdings_store().version()
+        if stamp == self._holdings_stamp:
+            return False
+        if self.portfolio_path:
+            self.holdings = pd.read_csv(self.portfolio_path)
+        else:
+            self.holdings = get_holdings_store().load()
+        self._holdings_stamp = stamp
+        print(f"Holdings reloaded: {len(self.holdings)} positions")
+        return True
+
+    def refresh_once(self):
+        """One repricing pass (blocking; run off the event loop)"""
+        if self.db.conn is None or self.db.conn.closed:
+            self.db.close()
+            self.db.connect()
+
+        holdings_changed = self._reload_holdings()
+        tickers = list(dict.fromkeys(self.holdings['Ticker']))
+
+        history_due = (
+            self._history_loaded_at is None
+            or time.monotonic() - self._history_loaded_at > self.history_refresh
+        )
+        if holdings_changed or history_due:
+            self.etl.extract_prices(tickers)
+            self._history_loaded_at = time.monotonic()
+        else:
+            self.etl.refresh_quotes(tickers)
+
+        self.etl.portfolio_df = self.holdings.copy()
+        portfolio_details, portfolio_metrics = self.etl.transform()
+
+        if holdings_changed:
+            self.db.save_initial_holdings(self.holdings)
+
+        # Only positions whose price moved since the last write
+        previous = self.last_prices.reindex(portfolio_details['Ticker']).to_numpy()
+        current = portfolio_details['CurrentPrice'].to_numpy()
+        moved = ~np.isclose(current, previous, rtol=0, atol=1e-9) & ~np.isnan(current)
+        if holdings_changed:
+            # Quantities may have changed even where prices did not
+            moved = ~np.isnan(current)
+        if not moved.any():
+            print("No price changes; nothing written")
+            return
+
+        self.db.save_portfolio_snapshot(portfolio_details[moved], portfolio_metrics,
+                                        partial=not holdings_changed)
+        self.last_prices = pd.Series(current, index=portfolio_details['Ticker'].to_numpy())
+        self.last_prices = self.last_prices[~self.last_prices.index.duplicated(keep='last')]
+        print(f"Snapshot written for {moved.sum()} of {len(portfolio_details)} positions "
+              f"(value ${portfolio_metrics['total_market_value']:,.2f})")
+
+    async def run(self):
+        """Reprice every interval seconds until stopped"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stop.set)
+
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.refresh_once)
+                    print(f"Refresh took {time.monotonic() - started:.3f}s")
+                except Exception as e:
+                    print(f"Refresh failed: {e}")
+                    if self.db.conn is not None and self.db.conn.closed:
+                        self.db.close()
+
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.db.close()
+            close_pool()
+            print("Refresh daemon stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the portfolio snapshot tables fresh")
+    parser.add_argument('--portfolio', help="portfolio CSV to watch instead of the holdings store")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between repricing passes")
+    parser.add_argument('--history-refresh', type=float, default=DEFAULT_HISTORY_REFRESH,
+                        help="seconds between incremental history pulls")
+    args = parser.parse_args()
+
+    daemon = RefreshDaemon(args.portfolio, interval=args.interval, history_refresh=args.history_refresh)
+    asyncio.run(daemon.run())
@@ -0,0 +1,110 @@
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from etl_pipeline import PortfolioETL
+from database import DatabaseManager
+
+STAGES = ['etl', 'connect', 'save_holdings', 'save_snapshot']
+# Finished jobs kept so late pollers can still read their result
+MAX_FINISHED_JOBS = 20
+
+
+class RefreshJob:
+    """One background ETL run and the sessions waiting on it"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'running'  # then 'succeeded' or 'failed'
+        self.stage = None
+        self.requests = 1        # clicks coalesced onto this run
+        self.started_at = datetime.now()
+        self.finished_at = None
+        self.outcome = None      # 'updated' or 'no_change'
+        self.metrics = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.status != 'running'
+
+    @property
+    def progress(self):
+        """Fraction of stages completed"""
+        if self.done:
+            return 1.0
+        return STAGES.index(self.stage) / len(STAGES) if self.stage else 0.0
+
+
+class RefreshWorker:
+    """Runs dashboard refreshes in the background, at most one at a time.
+
+    request() starts an ETL run on a worker thread, or joins the one already
+    in flight, so simultaneous clicks share a single download and snapshot.
+    Sessions keep the job id and poll job() for status, progress and result.
+    """
+
+    def __init__(self):
+        self._jobs = OrderedDict()  # id -> RefreshJob, oldest first
+        self._current = None
+        self._lock = threading.Lock()
+
+    def request(self):
+        """Return the in-flight job, starting one if none is running"""
+        with self._lock:
+            if self._current is not None:
+                self._current.requests += 1
+                return self._current
+            job = RefreshJob()
+            self._current = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_FINISHED_JOBS + 1:
+                self._jobs.popitem(last=False)
+        threading.Thread(target=self._run, args=(job,), name='refresh-worker', daemon=True).start()
+        return job
+
+    def job(self, job_id):
+        """Look up a job by id (None once it has aged out)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        etl = PortfolioETL()
+        db = DatabaseManager()
+        try:
+            # Connect only once prices are in, so a slow fetch doesn't hold a pooled connection
+            job.stage = 'etl'
+            portfolio_details, portfolio_metrics = etl.run()
+            job.stage = 'connect'
+            db.connect()
+            job.stage = 'save_holdings'
+            db.save_initial_holdings(portfolio_details)
+            job.stage = 'save_snapshot'
+            saved = db.save_portfolio_snapshot(portfolio_details, portfolio_metrics)
+
+            job.outcome = 'updated' if saved else 'no_change'
+            job.metrics = portfolio_metrics
+            job.status = 'succeeded'
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.now()
+            with self._lock:
+                self._current = None
+            # Hand the connection back to the shared pool
+            db.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_refresh_worker():
+    """Return the process-wide refresh worker"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = RefreshWorker()
+        return _worker
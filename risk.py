@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+
+
+class RiskModel:
+    """Daily mean returns and covariance matrix Σ for a fixed set of tickers.
+
+    Weights may be a Series indexed by ticker (one portfolio) or a DataFrame
+    with one row per scenario; tickers outside the model get zero weight.
+    Every method is a matrix-vector product against the stored Σ.
+    """
+
+    def __init__(self, tickers, mean_returns, covariance):
+        self.tickers = tickers
+        self.mean_returns = mean_returns
+        self.covariance = covariance
+
+    @classmethod
+    def from_history(cls, historical_data):
+        daily_returns = historical_data.pct_change().dropna()
+        returns = daily_returns.to_numpy(dtype=float)
+        n = returns.shape[1]
+        return cls(
+            list(daily_returns.columns),
+            returns.mean(axis=0),
+            np.cov(returns, rowvar=False, ddof=1).reshape(n, n)
+        )
+
+    def _weight_matrix(self, weights):
+        """Align weights to the model tickers as a (scenarios x tickers) array"""
+        if isinstance(weights, pd.Series):
+            weights = weights.to_frame().T
+        return weights.reindex(columns=self.tickers).fillna(0).to_numpy(dtype=float)
+
+    def _result(self, values, weights):
+        if isinstance(weights, pd.Series):
+            return float(values[0])
+        return pd.Series(values, index=weights.index)
+
+    def _daily_volatility(self, w):
+        return np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', w, self.covariance, w), 0))
+
+    def portfolio_volatility(self, weights, annualize=True):
+        """Portfolio standard deviation sqrt(w' Σ w)"""
+        volatility = self._daily_volatility(self._weight_matrix(weights))
+        if annualize:
+            volatility = volatility * np.sqrt(TRADING_DAYS)
+        return self._result(volatility, weights)
+
+    def expected_return(self, weights, annualize=True):
+        """Mean portfolio return w' μ"""
+        mean = self._weight_matrix(weights) @ self.mean_returns
+        if annualize:
+            mean = mean * TRADING_DAYS
+        return self._result(mean, weights)
+
+    def risk_contributions(self, weights):
+        """Marginal and component contributions to annualized volatility for one weight vector"""
+        w = self._weight_matrix(weights)[0]
+        sigma_w = self.covariance @ w
+        volatility = np.sqrt(max(w @ sigma_w, 0))
+        marginal = sigma_w / volatility if volatility else np.zeros_like(w)
+        component = w * marginal
+
+        return pd.DataFrame({
+            'Weight': w,
+            'MarginalRisk': marginal * np.sqrt(TRADING_DAYS),
+            'ComponentRisk': component * np.sqrt(TRADING_DAYS),
+            'RiskContributionPercent': component / volatility * 100 if volatility else 0.0
+        }, index=pd.Index(self.tickers, name='Ticker'))
+
+    def parametric_var(self, weights, portfolio_value, confidence=0.95, horizon_days=1):
+        """Gaussian value-at-risk in currency units over horizon_days"""
+        z = NormalDist().inv_cdf(confidence)
+        w = self._weight_matrix(weights)
+        var = portfolio_value * (
+            z * self._daily_volatility(w) * np.sqrt(horizon_days)
+            - (w @ self.mean_returns) * horizon_days
+        )
+        return self._result(np.maximum(var, 0), weights)
+
+
+class RiskEngine:
+    """Caches one RiskModel per price-data version.
+
+    Σ is only re-derived from prices when the history changes; what-if weight
+    changes reuse the cached model.
+    """
+
+    def __init__(self, max_versions=4):
+        self.max_versions = max_versions
+        self._models = OrderedDict()  # version -> RiskModel
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def data_version(historical_data):
+        """Cheap O(days x tickers) fingerprint of a Close frame"""
+        values = int(pd.util.hash_pandas_object(historical_data, index=True).sum())
+        return hash((values, tuple(historical_data.columns)))
+
+    def model(self, historical_data, version=None):
+        """Return the cached model for this price history, fitting it on first use"""
+        version = version if version is not None else self.data_version(historical_data)
+        with self._lock:
+            if version in self._models:
+                self._models.move_to_end(version)
+                return self._models[version]
+
+        model = RiskModel.from_history(historical_data)
+        with self._lock:
+            self._models[version] = model
+            while len(self._models) > self.max_versions:
+                self._models.popitem(last=False)
+        return model
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_risk_engine():
+    """Return the process-wide risk engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RiskEngine()
+        return _engine
@@ -0,0 +1,166 @@
+import json
+import math
+import os
+from collections import deque
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+# Re-sum the aggregates from the stored series this often to shed float drift
+RESUM_INTERVAL = TRADING_DAYS
+
+
+class RollingReturns:
+    """Trailing window of portfolio daily returns with running aggregates.
+
+    Keeps count, sum, sum of squares and sum of log(1 + r) (the log of the
+    cumulative product) for the completed trading days covered by the price
+    history, and persists them to a JSON file between runs. New days are
+    folded in with O(tickers) work and old days are subtracted as they leave
+    the history window, so the window matches the full recompute.
+
+    Returns are weighted with the weights in effect when the window was built;
+    the window is rebuilt from full history when the holdings change or the
+    live weights drift more than max_weight_drift (L1) away from them.
+    """
+
+    def __init__(self, path='rolling_returns.json', max_weight_drift=0.05):
+        self.path = path
+        self.max_weight_drift = max_weight_drift
+        self.reset()
+        self.load()
+
+    def reset(self):
+        """Forget all state"""
+        self.dates = deque()
+        self.returns = deque()
+        self.weights = {}
+        self.last_closes = {}
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.total_log = 0.0
+        self.updates_since_resum = 0
+
+    def load(self):
+        """Load persisted state if there is any"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.dates = deque(state['dates'])
+            self.returns = deque(state['returns'])
+            self.weights = state['weights']
+            self.last_closes = state['last_closes']
+            self._resum()
+        except Exception as e:
+            print(f"Ignoring unreadable rolling state {self.path}: {e}")
+            self.reset()
+
+    def save(self):
+        """Persist state atomically"""
+        state = {
+            'dates': list(self.dates),
+            'returns': list(self.returns),
+            'weights': self.weights,
+            'last_closes': self.last_closes,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def _resum(self):
+        returns = np.array(self.returns, dtype=float)
+        self.count = len(returns)
+        self.total = float(returns.sum())
+        self.total_sq = float((returns ** 2).sum())
+        self.total_log = float(np.log1p(returns).sum())
+        self.updates_since_resum = 0
+
+    def _push(self, date, daily_return):
+        self.dates.append(date)
+        self.returns.append(daily_return)
+        self.count += 1
+        self.total += daily_return
+        self.total_sq += daily_return ** 2
+        self.total_log += math.log1p(daily_return)
+
+        self.updates_since_resum += 1
+        if self.updates_since_resum >= RESUM_INTERVAL:
+            self._resum()
+
+    def _evict(self, through_date):
+        """Drop returns dated on or before through_date"""
+        through_date = through_date.strftime('%Y-%m-%d')
+        while self.dates and self.dates[0] <= through_date:
+            self.dates.popleft()
+            old = self.returns.popleft()
+            self.count -= 1
+            self.total -= old
+            self.total_sq -= old ** 2
+            self.total_log -= math.log1p(old)
+
+    def needs_rebuild(self, weights, historical_data):
+        """Whether the stored window can no longer be extended"""
+        if not self.dates or set(weights.index) != set(self.weights):
+            return True
+        if pd.Timestamp(self.dates[-1]) < historical_data.index[0]:
+            return True
+        stored = pd.Series(self.weights).reindex(weights.index)
+        return float((weights - stored).abs().sum()) > self.max_weight_drift
+
+    def rebuild(self, historical_data, weights):
+        """Recompute the window from full history (completed days only)"""
+        self.reset()
+        self.weights = {t: float(w) for t, w in weights.items()}
+        daily_returns = historical_data.pct_change().dropna()
+        portfolio_returns = (daily_returns * weights).sum(axis=1)
+        for date, daily_return in portfolio_returns.items():
+            self.dates.append(date.strftime('%Y-%m-%d'))
+            self.returns.append(float(daily_return))
+        self.last_closes = {t: float(c) for t, c in historical_data.ffill().iloc[-1].items()}
+        self._resum()
+
+    def _day_return(self, closes):
+        weights = pd.Series(self.weights)
+        previous = pd.Series(self.last_closes).reindex(weights.index)
+        # A ticker without a close that day is treated as unchanged
+        closes = closes.reindex(weights.index).fillna(previous)
+        return float((weights * (closes / previous - 1)).sum()), closes
+
+    def update(self, historical_data):
+        """Fold in completed days newer than the window and drop those older than the history"""
+        new_rows = historical_data[historical_data.index > pd.Timestamp(self.dates[-1])]
+        for date, closes in new_rows.iterrows():
+            daily_return, closes = self._day_return(closes)
+            self._push(date.strftime('%Y-%m-%d'), daily_return)
+            self.last_closes = {t: float(c) for t, c in closes.items()}
+        # The first day of history has no return of its own
+        self._evict(historical_data.index[0])
+        return len(new_rows)
+
+    def metrics(self, current_prices=None):
+        """Annualized metrics from the aggregates.
+
+        current_prices adds a provisional return for the session in progress
+        (not stored), costing O(tickers).
+        """
+        count, total, total_sq, total_log = self.count, self.total, self.total_sq, self.total_log
+        if current_prices is not None:
+            provisional, _ = self._day_return(current_prices)
+            count += 1
+            total += provisional
+            total_sq += provisional ** 2
+            total_log += math.log1p(provisional)
+
+        mean = total / count if count else np.nan
+        variance = (total_sq - total * total / count) / (count - 1) if count > 1 else np.nan
+        std = math.sqrt(max(variance, 0.0)) if not np.isnan(variance) else np.nan
+
+        return {
+            'total_return': (math.exp(total_log) - 1) * 100,
+            'volatility': std * np.sqrt(TRADING_DAYS) * 100,
+            'sharpe_ratio': (mean * TRADING_DAYS) / (std * np.sqrt(TRADING_DAYS)) if std else np.nan
+        }
@@ -1,26 +1,72 @@
+import argparse
 from etl_pipeline import PortfolioETL
-from database import DatabaseManager
+from database import DatabaseManager, close_pool
+from streaming_etl import StreamingETL, DEFAULT_CHUNK_SIZE
+from snapshot_archive import SnapshotArchive
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the portfolio ETL")
+    parser.add_argument('--prometheus-textfile', help="write run metrics to this Prometheus textfile")
+    parser.add_argument('--profile-transform', help="write a cProfile dump of transform to this path")
+    parser.add_argument('--streaming', action='store_true',
+                        help="fetch, value and load ticker chunks concurrently (flat memory for large portfolios)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="tickers per streaming chunk")
+    parser.add_argument('--sink', choices=['postgres', 'parquet', 'both'], default='postgres',
+                        help="where snapshots go; 'parquet' runs without the database")
+    parser.add_argument('--archive-dir', default='snapshot_archive', help="root of the Parquet snapshot archive")
+    args = parser.parse_args()
+
     # Initialize ETL and Database
-    etl = PortfolioETL()
+    etl = PortfolioETL(profile_transform=args.profile_transform)
     db = DatabaseManager()
-    
+    use_postgres = args.sink in ('postgres', 'both')
+    archive = SnapshotArchive(args.archive_dir) if args.sink in ('parquet', 'both') else None
+
     try:
         # Connect to database
-        db.connect()
-        
-        # Run ETL
-        portfolio_details, portfolio_metrics = etl.run()
-
-        db.save_initial_holdings(portfolio_details)
-        
-        # Save to database
-        db.save_portfolio_snapshot(portfolio_details, portfolio_metrics)
-        
-        print("ETL Pipeline completed")
-        
+        if use_postgres:
+            with etl.run_metrics.stage('connect'):
+                db.connect()
+
+        if args.streaming:
+            # Holdings and snapshot are written as chunks are valued
+            portfolio_details, portfolio_metrics = StreamingETL(
+                etl, db if use_postgres else None, chunk_size=args.chunk_size
+            ).run()
+        else:
+            # Run ETL
+            portfolio_details, portfolio_metrics = etl.run()
+
+            if use_postgres:
+                with etl.run_metrics.stage('save_holdings'):
+                    db.save_initial_holdings(portfolio_details)
+
+                # Save to database
+                with etl.run_metrics.stage('save_snapshot'):
+                    db.save_portfolio_snapshot(portfolio_details, portfolio_metrics)
+
+        # The archive checks its own latest fingerprint: the run's outcome comes from
+        # the memo, which doesn't know whether an earlier archive write went through
+        if archive is not None:
+            with etl.run_metrics.stage('save_archive'):
+                archive.save_portfolio_snapshot(portfolio_details, portfolio_metrics)
+            # Merge the small per-run files of past days; a no-op once they are merged
+            with etl.run_metrics.stage('compact_archive'):
+                archive.compact()
+
+        if etl.run_metrics.outcome == 'no_change':
+            print("ETL Pipeline completed (no change)")
+        else:
+            print("ETL Pipeline completed")
+
     except Exception as e:
         print(f"ETL Pipeline failed: {e}")
     finally:
         db.close()
+        close_pool()
+
+        etl.run_metrics.increment('db_round_trips', db.round_trips)
+        etl.run_metrics.increment('rows_written', db.rows_written)
+        etl.run_metrics.log_json()
+        if args.prometheus_textfile:
+            etl.run_metrics.write_prometheus(args.prometheus_textfile)
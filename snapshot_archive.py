@@ -0,0 +1,228 @@
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+import pandas as pd
+from database import DEFAULT_PORTFOLIO_ID, HISTORY_POINTS
+from downsample import lttb
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for the Parquet archive
+    pa = None
+
+PORTFOLIO_TABLE = 'portfolio_snapshots'
+HOLDINGS_TABLE = 'holdings_snapshot'
+
+
+def _schemas():
+    """Fixed Arrow schema per table, partition column included.
+
+    Inferring it per write would type an all-None column (e.g. a streamed
+    run's input_fingerprint) as null, which later can't be read alongside
+    files where it is a string.
+    """
+    date = pa.field('date', pa.date32())
+    timestamp = pa.field('snapshot_date', pa.timestamp('us'))
+    return {
+        PORTFOLIO_TABLE: pa.schema([
+            ('portfolio_id', pa.string()), timestamp,
+            ('total_value', pa.float64()), ('total_return', pa.float64()),
+            ('volatility', pa.float64()), ('sharpe_ratio', pa.float64()),
+            ('total_unrealized_pnl', pa.float64()), ('input_fingerprint', pa.string()),
+            date
+        ]),
+        HOLDINGS_TABLE: pa.schema([
+            ('portfolio_id', pa.string()), timestamp, ('ticker', pa.string()),
+            ('quantity', pa.int64()), ('current_price', pa.float64()),
+            ('market_value', pa.float64()), ('unrealized_pnl', pa.float64()),
+            date
+        ]),
+    }
+
+
+def _day(value):
+    return pd.Timestamp(value).date()
+
+
+class SnapshotArchive:
+    """Portfolio and holdings snapshots as Parquet files partitioned by day.
+
+    Layout is <root>/<table>/date=YYYY-MM-DD/<file>.parquet with the same
+    columns as the Postgres tables, so it can stand in for (or sit beside)
+    DatabaseManager as a snapshot sink. Reads go through memory-mapped Arrow
+    datasets; date filters prune whole partitions and ticker filters are
+    pushed down to row-group statistics (rows are written sorted by ticker).
+    """
+
+    def __init__(self, root='snapshot_archive'):
+        if pa is None:
+            raise ImportError("The Parquet snapshot archive needs pyarrow (pip install pyarrow)")
+        self.root = root
+        self.partitioning = ds.partitioning(pa.schema([('date', pa.date32())]), flavor='hive')
+        self.schemas = _schemas()
+
+    def _file_schema(self, table_name):
+        """Schema of the files themselves, without the partition column"""
+        schema = self.schemas[table_name]
+        return schema.remove(schema.get_field_index('date'))
+
+    def _write(self, table_name, frame):
+        frame = frame.assign(date=pd.to_datetime(frame['snapshot_date']).dt.date)
+        pq.write_to_dataset(
+            pa.Table.from_pandas(frame, schema=self.schemas[table_name], preserve_index=False),
+            os.path.join(self.root, table_name),
+            partitioning=self.partitioning,
+            basename_template=f"{uuid.uuid4().hex}-{{i}}.parquet"
+        )
+
+    def get_latest_fingerprint(self, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Input fingerprint of the portfolio's latest archived snapshot (None if unknown)"""
+        path = os.path.join(self.root, PORTFOLIO_TABLE)
+        if not os.path.isdir(path):
+            return None
+        # Only the newest day that has a snapshot for this portfolio needs reading
+        days = sorted((name for name in os.listdir(path) if name.startswith('date=')), reverse=True)
+        for partition in days:
+            day = partition.split('=', 1)[1]
+            latest = self._read(PORTFOLIO_TABLE, columns=['snapshot_date', 'input_fingerprint'],
+                                start=day, end=pd.Timestamp(day) + pd.Timedelta(days=1),
+                                portfolio_id=portfolio_id)
+            if len(latest):
+                fingerprint = latest['input_fingerprint'].iloc[-1]
+                return None if pd.isna(fingerprint) else fingerprint
+        return None
+
+    def save_portfolio_snapshot(self, portfolio_details, portfolio_metrics, portfolio_id=DEFAULT_PORTFOLIO_ID):
+        """Append one snapshot, mirroring DatabaseManager.save_portfolio_snapshot.
+
+        Returns False without writing when the metrics carry the same input
+        fingerprint as the portfolio's latest archived snapshot.
+        """
+        fingerprint = portfolio_metrics.get('input_fingerprint')
+        if fingerprint is not None and fingerprint == self.get_latest_fingerprint(portfolio_id):
+            print("Inputs unchanged since the latest archived snapshot; nothing archived")
+            return False
+        timestamp = pd.Timestamp(portfolio_metrics['timestamp'])
+        self._write(PORTFOLIO_TABLE, pd.DataFrame([{
+            'portfolio_id': portfolio_id,
+            'snapshot_date': timestamp,
+            'total_value': float(portfolio_metrics['total_market_value']),
+            'total_return': float(portfolio_metrics['total_return_percent']),
+            'volatility': float(portfolio_metrics['volatility']),
+            'sharpe_ratio': float(portfolio_metrics['sharpe_ratio']),
+            'total_unrealized_pnl': float(portfolio_metrics['total_unrealized_pnl']),
+            'input_fingerprint': portfolio_metrics.get('input_fingerprint')
+        }]))
+
+        priced = portfolio_details[~portfolio_details['PriceMissing'].to_numpy(dtype=bool)]
+        self._write(HOLDINGS_TABLE, pd.DataFrame({
+            'portfolio_id': portfolio_id,
+            'snapshot_date': timestamp,
+            'ticker': priced['Ticker'].astype(str),
+            'quantity': priced['Quantity'].astype(int),
+            'current_price': priced['CurrentPrice'].astype(float),
+            'market_value': priced['MarketValue'].astype(float),
+            'unrealized_pnl': priced['UnrealizedPnl'].astype(float)
+        }).sort_values('ticker'))
+        print(f"Portfolio snapshot archived under {self.root}")
+        return True
+
+    def _read(self, table_name, columns=None, start=None, end=None, portfolio_id=None, tickers=None):
+        """Read a table with date/portfolio/ticker predicates pushed down to the scan"""
+        path = os.path.join(self.root, table_name)
+        if not os.path.isdir(path):
+            return pd.DataFrame(columns=columns or ['snapshot_date'])
+
+        filters = []
+        if start is not None:
+            filters.append(('date', '>=', _day(start)))
+        if end is not None:
+            filters.append(('date', '<=', _day(end)))
+        if portfolio_id is not None:
+            filters.append(('portfolio_id', '=', portfolio_id))
+        if tickers is not None:
+            filters.append(('ticker', 'in', list(tickers)))
+
+        dataset = pq.ParquetDataset(
+            path, schema=self.schemas[table_name], partitioning=self.partitioning,
+            memory_map=True, filters=filters or None
+        )
+        frame = dataset.read(columns=columns).to_pandas()
+        # Partitions are whole days; trim to the exact timestamps asked for
+        if start is not None:
+            frame = frame[frame['snapshot_date'] >= pd.Timestamp(start)]
+        if end is not None:
+            frame = frame[frame['snapshot_date'] <= pd.Timestamp(end)]
+        return frame.sort_values('snapshot_date').reset_index(drop=True)
+
+    def read_portfolio_snapshots(self, portfolio_id=DEFAULT_PORTFOLIO_ID, start=None, end=None):
+        """portfolio_snapshots rows in [start, end]"""
+        return self._read(PORTFOLIO_TABLE, start=start, end=end, portfolio_id=portfolio_id)
+
+    def read_holdings_snapshots(self, portfolio_id=DEFAULT_PORTFOLIO_ID, start=None, end=None, tickers=None):
+        """holdings_snapshot rows in [start, end], optionally only for some tickers"""
+        return self._read(HOLDINGS_TABLE, start=start, end=end, portfolio_id=portfolio_id, tickers=tickers)
+
+    def get_portfolio_history(self, portfolio_id=DEFAULT_PORTFOLIO_ID, start=None, end=None,
+                              points=HISTORY_POINTS):
+        """Same frame as DatabaseManager.get_portfolio_history, read from the archive"""
+        history = self._read(
+            PORTFOLIO_TABLE,
+            columns=['snapshot_date', 'total_value', 'total_unrealized_pnl', 'total_return'],
+            start=start, end=end, portfolio_id=portfolio_id
+        )
+        history['snapshots'] = 1
+        keep = lttb(history['snapshot_date'].astype('int64'), history['total_value'], points)
+        return history.iloc[keep].reset_index(drop=True)
+
+    def compact(self, before=None):
+        """Merge each past day's files into one file per table; return the number of days rewritten"""
+        before = _day(before if before is not None else datetime.now())
+        rewritten = 0
+        for table_name in (PORTFOLIO_TABLE, HOLDINGS_TABLE):
+            table_path = os.path.join(self.root, table_name)
+            if not os.path.isdir(table_path):
+                continue
+            for partition in sorted(os.listdir(table_path)):
+                if not partition.startswith('date='):
+                    continue
+                day = _day(partition.split('=', 1)[1])
+                partition_path = os.path.join(table_path, partition)
+                files = [name for name in os.listdir(partition_path) if name.endswith('.parquet')]
+                if day >= before or len(files) < 2:
+                    continue
+
+                table = pq.read_table(
+                    partition_path, schema=self._file_schema(table_name), partitioning=None
+                )
+                order = ['ticker', 'snapshot_date'] if table_name == HOLDINGS_TABLE else ['snapshot_date']
+                table = table.sort_by([(column, 'ascending') for column in order])
+                # Build the merged partition under a dot-name (which dataset scans skip), then swap it in
+                tmp_path = os.path.join(table_path, '.compacting-' + partition)
+                old_path = os.path.join(table_path, '.replaced-' + partition)
+                os.makedirs(tmp_path, exist_ok=True)
+                pq.write_table(table, os.path.join(tmp_path, f"{uuid.uuid4().hex}-0.parquet"))
+                os.replace(partition_path, old_path)
+                os.replace(tmp_path, partition_path)
+                shutil.rmtree(old_path)
+                rewritten += 1
+        if rewritten:
+            print(f"Snapshot archive compacted: {rewritten} day partitions")
+        return rewritten
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_snapshot_archive():
+    """Return the process-wide archive (root from SNAPSHOT_ARCHIVE)"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = SnapshotArchive(os.environ.get('SNAPSHOT_ARCHIVE', 'snapshot_archive'))
+        return _archive
@@ -0,0 +1,226 @@
+import queue
+import threading
+from datetime import datetime
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from database import DEFAULT_PORTFOLIO_ID
+from etl_pipeline import FALLBACK_SOURCE
+from market_data import get_provider
+from risk import TRADING_DAYS
+from valuation import value_holdings
+
+DEFAULT_CHUNK_SIZE = 500  # tickers per chunk
+DEFAULT_QUEUE_DEPTH = 2   # chunks buffered between stages before the producer blocks
+_DONE = object()
+
+
+class StreamingETL:
+    """Runs a PortfolioETL as three overlapping stages over ticker chunks.
+
+    fetch (history + spot prices) -> value (holdings + aggregates) -> load (COPY)
+
+    Stages are threads joined by bounded queues, so a slow stage back-pressures
+    the ones before it and at most queue_depth chunks of history are held at
+    once. Portfolio metrics are combined from per-chunk partial sums: the
+    value-weighted daily return vector gives the same total return,
+    volatility (w' Σ w is the variance of that vector), Sharpe ratio and VaR
+    as the full recompute, without keeping the whole history in memory.
+    Risk contributions need Σ itself and are not produced. Inputs are
+    fingerprinted chunk by chunk to the same hash as PortfolioETL's, and an
+    unchanged run is rolled back instead of committed.
+    """
+
+    def __init__(self, etl, db=None, portfolio_id=DEFAULT_PORTFOLIO_ID,
+                 chunk_size=DEFAULT_CHUNK_SIZE, queue_depth=DEFAULT_QUEUE_DEPTH):
+        self.etl = etl
+        self.db = db  # when given, the snapshot is written as chunks are valued
+        self.portfolio_id = portfolio_id
+        self.chunk_size = chunk_size
+        self.queue_depth = queue_depth
+        self._failed = threading.Event()
+        self._errors = []
+        self._price_hashes = []  # per-chunk _price_hashes, in ticker order
+        self.saved = None        # whether the load stage committed a snapshot
+
+    def _put(self, q, item):
+        """Blocking put that gives up once another stage has failed"""
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _items(self, q):
+        """Yield items until the upstream stage finishes or any stage fails"""
+        while not self._failed.is_set():
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _run_stage(self, work, *args):
+        try:
+            work(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._failed.set()
+
+    def _fetch(self, tickers, out):
+        """Load history and spot prices one chunk of tickers at a time"""
+        etl = self.etl
+        for start in range(0, len(tickers), self.chunk_size):
+            chunk = tickers[start:start + self.chunk_size]
+            with etl.run_metrics.stage('stream_fetch'):
+                history = etl._load_history(chunk, compact=False)
+                prices, sources = etl._spot_prices(chunk, history)
+                self._price_hashes.append(etl._price_hashes(prices, sources, history))
+            if not self._put(out, (history, prices, sources)):
+                return
+        if etl.price_store is not None:
+            etl.price_store.compact()
+        self._put(out, _DONE)
+
+    def _value(self, inbound, out):
+        """Value each chunk's holdings and fold it into the portfolio aggregates"""
+        holdings = self.etl.portfolio_df
+        totals = np.zeros(3)  # market value, cost basis, missing prices
+        weighted_returns = pd.Series(dtype=float)  # sum of value_i * return_i per day
+        return_counts = pd.Series(dtype=float)     # tickers with a return per day
+        history_tickers = 0
+        history_value = 0.0
+        details = []
+
+        for history, prices, sources in self._items(inbound):
+            with self.etl.run_metrics.stage('stream_value'):
+                chunk = holdings[holdings['Ticker'].isin(prices.index)]
+                valued = value_holdings(chunk, prices)
+                valued['PriceSource'] = sources.reindex(valued['Ticker']).fillna('missing').to_numpy()
+                valued['PriceStale'] = valued['PriceSource'].to_numpy() == FALLBACK_SOURCE
+                if valued['PriceStale'].any():
+                    self.etl.run_metrics.increment('stale_prices', int(valued['PriceStale'].sum()))
+                priced = ~valued['PriceMissing'].to_numpy()
+                totals += (
+                    valued['MarketValue'].to_numpy()[priced].sum(),
+                    valued['CostBasis'].to_numpy()[priced].sum(),
+                    (~priced).sum()
+                )
+
+                # Same inputs as _full_metrics, restricted to this chunk's tickers
+                history = history.dropna(axis=1, how='all')
+                returns = history.pct_change()
+                quantities = chunk.groupby('Ticker')['Quantity'].sum()
+                values = history.iloc[-1] * quantities.reindex(history.columns)
+                weighted_returns = weighted_returns.add((returns * values).sum(axis=1), fill_value=0)
+                return_counts = return_counts.add(returns.notna().sum(axis=1), fill_value=0)
+                history_tickers += history.shape[1]
+                history_value += float(np.nansum(values))
+
+            details.append(valued)
+            self.etl.run_metrics.increment('chunks')
+            if self.db is not None and not self._put(out, valued):
+                return
+        if self._failed.is_set():
+            return
+
+        # Days where every ticker has a return, as dropna() keeps in _full_metrics
+        complete = return_counts == history_tickers
+        portfolio_returns = weighted_returns[complete] / history_value if history_value else pd.Series(dtype=float)
+        self.portfolio_details = pd.concat(details, ignore_index=True) if details else holdings.iloc[:0]
+        self.portfolio_metrics = self._metrics(totals, portfolio_returns)
+        # The fetch stage has finished every chunk by the time _DONE reached us
+        self.etl.input_fingerprint = self.etl.fingerprint_inputs([
+            np.concatenate([hashes[i] for hashes in self._price_hashes]) if self._price_hashes
+            else np.array([], dtype=np.uint64)
+            for i in range(3)
+        ])
+        self.portfolio_metrics['input_fingerprint'] = self.etl.input_fingerprint
+        if self.db is not None:
+            self._put(out, _DONE)
+
+    def _load(self, inbound, snapshot_id):
+        """COPY each valued chunk, then complete the snapshot in the same transaction"""
+        for valued in self._items(inbound):
+            with self.etl.run_metrics.stage('stream_load'):
+                self.db.write_streamed_holdings(snapshot_id, valued, self.timestamp, self.portfolio_id)
+        if self._failed.is_set():
+            return
+        with self.etl.run_metrics.stage('stream_load'):
+            self.saved = self.db.finish_streamed_snapshot(snapshot_id, self.portfolio_metrics, self.portfolio_id)
+
+    def _metrics(self, totals, portfolio_returns):
+        """Portfolio metrics dict, matching PortfolioETL.transform"""
+        market_value, cost_basis, missing = totals
+        pnl = market_value - cost_basis
+
+        daily_volatility = portfolio_returns.std(ddof=1)
+        daily_mean = portfolio_returns.mean()
+        volatility = daily_volatility * np.sqrt(TRADING_DAYS)
+        z = NormalDist().inv_cdf(0.95)
+
+        return {
+            'timestamp': self.timestamp,
+            'total_market_value': float(market_value),
+            'total_cost_basis': float(cost_basis),
+            'total_unrealized_pnl': float(pnl),
+            'total_return_percent': pnl / cost_basis * 100 if cost_basis > 0 else 0.0,
+            'missing_prices': int(missing),
+            'volatility': volatility * 100,
+            'sharpe_ratio': daily_mean * TRADING_DAYS / volatility,
+            'annual_return': ((portfolio_returns + 1).prod() - 1) * 100,
+            'value_at_risk': max(z * daily_volatility - daily_mean, 0) * 100
+        }
+
+    def run(self):
+        """Run the pipeline; return (portfolio_details, portfolio_metrics) like PortfolioETL.run"""
+        etl = self.etl
+        if etl.provider is None:
+            etl.provider = get_provider()
+        etl.failed_tickers = set()
+        with etl.run_metrics.stage('extract'):
+            holdings = etl.read_holdings()
+        tickers = list(dict.fromkeys(holdings['Ticker']))
+        self.timestamp = datetime.now()
+
+        snapshot_id = None
+        if self.db is not None:
+            with etl.run_metrics.stage('stream_load'):
+                snapshot_id = self.db.begin_streamed_snapshot(holdings, self.timestamp, self.portfolio_id)
+
+        fetched = queue.Queue(maxsize=self.queue_depth)
+        valued = queue.Queue(maxsize=self.queue_depth)
+        stages = [
+            threading.Thread(target=self._run_stage, args=(self._fetch, tickers, fetched), name='etl-fetch'),
+            threading.Thread(target=self._run_stage, args=(self._value, fetched, valued), name='etl-value'),
+        ]
+        if self.db is not None:
+            stages.append(threading.Thread(
+                target=self._run_stage, args=(self._load, valued, snapshot_id), name='etl-load'
+            ))
+
+        with etl.run_metrics.stage('stream'):
+            for stage in stages:
+                stage.start()
+            for stage in stages:
+                stage.join()
+
+        if self._errors:
+            if self.db is not None:
+                self.db.conn.rollback()
+            print(f"Streaming ETL failed: {self._errors[0]}")
+            raise self._errors[0]
+
+        etl.portfolio_df = self.portfolio_details
+        etl.run_metrics.outcome = 'no_change' if self.saved is False else 'updated'
+        etl.run_metrics.increment('holdings', len(self.portfolio_details))
+        metrics = self.portfolio_metrics
+        print(f"Portfolio Value: ${metrics['total_market_value']:,.2f}")
+        print(f"Total Return: {metrics['total_return_percent']:.2f}%")
+        print(f"Annual Volatility: {metrics['volatility']:.2f}%")
+        print(f"Sharpe Ratio: {metrics['sharpe_ratio']:.2f}")
+        return self.portfolio_details, metrics
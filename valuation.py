@@ -0,0 +1,47 @@
+import numpy as np
+
+
+def value_holdings(holdings_df, prices):
+    """Value every holding against a Series of prices indexed by ticker.
+
+    Returns a copy of holdings_df with CurrentPrice, MarketValue, CostBasis,
+    UnrealizedPnl, UnrealizedPnlPercent and PriceMissing columns, computed in
+    one vectorized pass. A ticker with no price keeps NaN in the price-derived
+    columns and is flagged in PriceMissing rather than being valued at 0.
+    """
+    prices = prices[~prices.index.duplicated(keep='last')]
+
+    quantity = holdings_df['Quantity'].to_numpy(dtype=float)
+    purchase_price = holdings_df['PurchasePrice'].to_numpy(dtype=float)
+    current_price = prices.reindex(holdings_df['Ticker']).to_numpy(dtype=float)
+
+    market_value = quantity * current_price
+    cost_basis = quantity * purchase_price
+    pnl = market_value - cost_basis
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pnl_percent = np.where(cost_basis > 0, pnl / cost_basis * 100, 0.0)
+
+    return holdings_df.assign(
+        CurrentPrice=current_price,
+        MarketValue=market_value,
+        CostBasis=cost_basis,
+        UnrealizedPnl=pnl,
+        UnrealizedPnlPercent=np.where(np.isnan(current_price), np.nan, pnl_percent),
+        PriceMissing=np.isnan(current_price),
+    )
+
+
+def summarize(valued_df):
+    """Portfolio totals over the holdings that have a price"""
+    priced = ~valued_df['PriceMissing'].to_numpy()
+    total_market_value = float(valued_df['MarketValue'].to_numpy()[priced].sum())
+    total_cost_basis = float(valued_df['CostBasis'].to_numpy()[priced].sum())
+    total_pnl = total_market_value - total_cost_basis
+
+    return {
+        'total_market_value': total_market_value,
+        'total_cost_basis': total_cost_basis,
+        'total_unrealized_pnl': total_pnl,
+        'total_return_percent': (total_pnl / total_cost_basis) * 100 if total_cost_basis > 0 else 0.0,
+        'missing_prices': int((~priced).sum()),
+    }